@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+    offline benchmarks for the update pipeline
+
+    starts a local HTTP server standing in for the documents being tracked
+    and times Kernel.track_url/track_urls, get_update_queue,
+    claim_update_queue, update/update_many and the storage engines against
+    it, reporting throughput, p50/p99 latency and peak memory as JSON
+
+    requires a local mongodb, uses (and wipes) the oyster_bench database
+
+    example: python benchmarks/bench_update.py --docs 100000 --latency 0.05
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from oyster.core import Kernel
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    serves /<n> with a body of server.size bytes which changes with
+    probability server.change_probability on each request
+    """
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        with server.lock:
+            revision = server.revisions.get(self.path, 0)
+            if random.random() < server.change_probability:
+                revision += 1
+                server.revisions[self.path] = revision
+
+        etag = '"%s-%s"' % (self.path, revision)
+        if server.etags and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        # repetitive text, much like the html we usually track
+        line = '%s revision %s\n' % (self.path, revision)
+        body = (line * (server.size / len(line) + 1))[:server.size]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        if server.etags:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency, size, change_probability, etags):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           StandInHandler)
+        self.latency = latency
+        self.size = size
+        self.change_probability = change_probability
+        self.etags = etags
+        self.revisions = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/' % self.server_address[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(pct / 100. * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class Timer(object):
+    """ collects per-operation latencies for one benchmark """
+
+    def __init__(self, name, results):
+        self.name = name
+        self.results = results
+        self.latencies = []
+        self.items = 0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.time() - self.start
+        self.results.append({
+            'benchmark': self.name,
+            'items': self.items,
+            'seconds': elapsed,
+            'throughput': self.items / elapsed if elapsed else None,
+            'p50': percentile(self.latencies, 50),
+            'p99': percentile(self.latencies, 99),
+            'peak_memory_mb': peak_memory_mb(),
+        })
+
+    def time(self, func, *args, **kwargs):
+        start = time.time()
+        result = func(*args, **kwargs)
+        self.latencies.append(time.time() - start)
+        self.items += 1
+        return result
+
+
+def bench_track(kernel, server, args, results):
+    with Timer('track_url', results) as timer:
+        for i in xrange(args.docs / 2):
+            timer.time(kernel.track_url, server.url + str(i), 'bench')
+
+    specs = ({'url': server.url + str(i), 'doc_class': 'bench'}
+             for i in xrange(args.docs / 2, args.docs))
+    with Timer('track_urls', results) as timer:
+        batch = []
+        for spec in specs:
+            batch.append(spec)
+            if len(batch) == 1000:
+                timer.time(kernel.track_urls, batch)
+                batch = []
+        if batch:
+            timer.time(kernel.track_urls, batch)
+        timer.items = args.docs - args.docs / 2
+
+
+def bench_queue(kernel, args, results):
+    with Timer('get_update_queue', results) as timer:
+        queue = timer.time(kernel.get_update_queue)
+        timer.items = len(queue)
+    del queue
+
+    with Timer('get_update_queue_size', results) as timer:
+        timer.time(kernel.get_update_queue_size)
+
+    with Timer('claim_update_queue', results) as timer:
+        claimed = 0
+        while claimed < args.updates:
+            ids = timer.time(kernel.claim_update_queue,
+                             min(1000, args.updates - claimed))
+            if not ids:
+                break
+            claimed += len(ids)
+        timer.items = claimed
+    # release leases for the update benchmarks
+    kernel.db.tracked.update({}, {'$set': {'lease_until': None}}, multi=True)
+
+
+def bench_update(kernel, args, results):
+    docs = kernel.db.tracked.find().limit(args.updates)
+    with Timer('update', results) as timer:
+        for doc in docs:
+            timer.time(kernel.update, doc)
+
+    # second pass sees existing versions (and validators with --etags)
+    docs = list(kernel.db.tracked.find().limit(args.updates))
+    with Timer('update_many', results) as timer:
+        for i in xrange(0, len(docs), args.batch_size):
+            timer.time(kernel.update_many, docs[i:i + args.batch_size],
+                       concurrency=args.concurrency)
+        timer.items = len(docs)
+
+
+def bench_storage(kernel, args, results):
+    data = 'x' * args.size
+    for name, storage in sorted(kernel.storage.iteritems()):
+        doc = {'_id': 'bench', 'url': 'http://example.com/bench',
+               'doc_class': 'bench', 'metadata': {}}
+        keys = []
+        try:
+            with Timer('storage_put[%s]' % name, results) as timer:
+                for i in xrange(args.storage_ops):
+                    doc['_id'] = 'bench%s' % i
+                    keys.append(timer.time(storage.put, doc, data,
+                                           'text/plain'))
+            with Timer('storage_get[%s]' % name, results) as timer:
+                for key in keys:
+                    timer.time(storage.get, key)
+        except Exception as e:
+            # s3 and the like may not be configured
+            results.append({'benchmark': 'storage[%s]' % name,
+                            'error': str(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark the oyster update pipeline offline',
+    )
+    parser.add_argument('--docs', type=int, default=10000,
+                        help='number of documents to track')
+    parser.add_argument('--updates', type=int, default=1000,
+                        help='number of documents to update')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the stand-in server waits per request')
+    parser.add_argument('--size', type=int, default=10000,
+                        help='response body size in bytes')
+    parser.add_argument('--change-probability', type=float, default=0.1,
+                        help='chance a document changes between requests')
+    parser.add_argument('--etags', action='store_true',
+                        help='send ETags and honor If-None-Match')
+    parser.add_argument('--storage', default='dummy',
+                        help='storage engine for tracked documents')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--storage-ops', type=int, default=1000)
+    parser.add_argument('--output', type=str,
+                        help='write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency, args.size, args.change_probability,
+                           args.etags)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    doc_classes = {'bench': {'update_mins': 60, 'onchanged': [],
+                             'storage_engine': args.storage}}
+    kernel = Kernel(mongo_db='oyster_bench', rpm=0, doc_classes=doc_classes)
+    kernel._wipe()
+
+    results = []
+    bench_track(kernel, server, args, results)
+    bench_queue(kernel, args, results)
+    bench_update(kernel, args, results)
+    bench_storage(kernel, args, results)
+    kernel._wipe()
+    server.shutdown()
+
+    report = {'args': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@ MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
 MONGO_DATABASE = 'oyster'
 MONGO_LOG_MAXSIZE = 100000000
+# write logs in batches from a background thread
+MONGO_LOG_BUFFERED = False
 
 # extra celery modules
 CELERY_TASK_MODULES = []
@@ -12,6 +14,41 @@ USER_AGENT = 'oyster'
 REQUESTS_PER_MINUTE = 60
 REQUEST_TIMEOUT = 300
 
+# per-host limits shared by all workers, 0 for no limit
+# doc_classes can override with host_rpm/host_concurrency
+HOST_REQUESTS_PER_MINUTE = 0
+HOST_CONCURRENCY = 0
+
+# doc_classes with stream=True are read in chunks of STREAM_CHUNK_BYTES and
+# spooled to disk once larger than STREAM_SPOOL_BYTES
+STREAM_CHUNK_BYTES = 65536
+STREAM_SPOOL_BYTES = 1048576
+
+# scheduler keeps up to UPDATE_QUEUE_SIZE documents queued, documents are
+# leased while queued and return to the queue if not updated within
+# UPDATE_LEASE_MINUTES
+UPDATE_QUEUE_SIZE = 1000
+UPDATE_LEASE_MINUTES = 60
+
+# number of fetches UpdateManyTask keeps in flight
+UPDATE_CONCURRENCY = 10
+
+# scheduler sends documents to workers UPDATE_CHUNK_SIZE at a time, with more
+# than 1 each chunk is a single UpdateManyTask
+UPDATE_CHUNK_SIZE = 1
+
+# dashboard status summary is refreshed every STATUS_SUMMARY_SECONDS and
+# recomputed on request if older than STATUS_SUMMARY_TTL
+STATUS_SUMMARY_SECONDS = 60
+STATUS_SUMMARY_TTL = 300
+
+# how often each process adds its metrics to the shared collection
+METRICS_FLUSH_SECONDS = 10
+
+# record per-phase timings of each update in the log & update_stats,
+# UPDATE_TIMING_HOOK(doc, timer) is also called if set
+UPDATE_TIMING = False
+
 # other
 RETRY_ATTEMPTS = 3
 RETRY_WAIT_MINUTES = 60
@@ -19,3 +56,13 @@ RETRY_WAIT_MINUTES = 60
 DOCUMENT_CLASSES = {}
 
 DEFAULT_STORAGE_ENGINE = 'dummy'
+
+# in-memory cache of data read from storage (0 to disable), optionally
+# shared by all workers on a host through STORAGE_CACHE_DIR
+STORAGE_CACHE_BYTES = 0
+STORAGE_CACHE_DIR = ''
+STORAGE_CACHE_DIR_BYTES = 1024 * 1024 * 1024
+
+# filesystem storage engine
+FILESYSTEM_STORAGE_ROOT = 'oyster_storage'
+FILESYSTEM_STORAGE_FSYNC = False
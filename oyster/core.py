@@ -3,23 +3,73 @@ import logging
 import hashlib
 import random
 import sys
+import tempfile
+import time
+import zlib
+import threading
+from multiprocessing.pool import ThreadPool
 
+import bson.binary
+import bson.objectid
 import pymongo
 import scrapelib
 
 from .mongolog import MongoHandler
+from .hosts import HostThrottle, url_host
+from .metrics import Metrics
+from .timing import PhaseTimer, NULL_TIMER
 from .storage import engines
+from .storage.dedup import DedupStorage
+from .storage import compression
+from .storage import delta
+from .storage.cache import StorageCache
 from celery.execute import send_task
 
 
+# track_urls result statuses
+TRACK_CREATED = 'created'
+TRACK_UNCHANGED = 'unchanged'
+TRACK_UPDATED = 'updated'
+TRACK_CONFLICT = 'conflict'
+
+
+class LockedScraper(scrapelib.Scraper):
+    """
+    scraper that can be shared by update_many's threads
+
+    scrapelib's throttle has no lock, so threads would all read the same
+    last request time, sleep the same amount & then fire together
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LockedScraper, self).__init__(*args, **kwargs)
+        self._throttle_lock = threading.Lock()
+
+    def _throttle(self, *args, **kwargs):
+        with self._throttle_lock:
+            return super(LockedScraper, self)._throttle(*args, **kwargs)
+
+
 class Kernel(object):
     """ oyster's workhorse, handles tracking """
 
+    # leave room under mongo's 16MB document limit
+    MAX_CACHED_TEXT_BYTES = 15 * 1024 * 1024
+
+    # weight of the latest gap between versions in a document's change_mins
+    CHANGE_ESTIMATE_WEIGHT = 0.5
+
     def __init__(self, mongo_host='localhost', mongo_port=27017,
                  mongo_db='oyster', mongo_log_maxsize=100000000,
+                 mongo_log_buffered=False,
                  user_agent='oyster', rpm=60, timeout=300,
                  retry_attempts=3, retry_wait_minutes=60,
                  doc_classes=None, default_storage_engine='dummy',
+                 host_rpm=None, host_concurrency=None,
+                 stream_chunk_bytes=65536, stream_spool_bytes=1048576,
+                 storage_cache_bytes=0, storage_cache_dir=None,
+                 storage_cache_dir_bytes=None, metrics_flush_seconds=10,
+                 timing=False, timing_hook=None,
                 ):
         """
         configurable for ease of testing, only one should be instantiated
@@ -32,29 +82,71 @@ class Kernel(object):
         self.log.setLevel(logging.DEBUG)
         self.log.addHandler(MongoHandler(mongo_db, host=mongo_host,
                                          port=mongo_port,
-                                         capped_size=mongo_log_maxsize))
+                                         capped_size=mongo_log_maxsize,
+                                         buffered=mongo_log_buffered))
 
-        # create status document if it doesn't exist
-        if self.db.status.count() == 0:
-            self.db.status.insert({'update_queue': 0})
-
-        # ensure an index on _random
+        # indices for the update queue & lookups
         self.db.tracked.ensure_index('_random')
         self.db.tracked.ensure_index('url')
+        self.db.tracked.ensure_index([('next_update', pymongo.ASCENDING),
+                                      ('_random', pymongo.ASCENDING)])
+        self.db.tracked.ensure_index('lease_until')
+        self.db.tracked.ensure_index('lease_token', sparse=True)
+        self.db.tracked.ensure_index([('doc_class', pymongo.ASCENDING),
+                                      ('next_update', pymongo.ASCENDING)])
+        self.db.tracked.ensure_index('consecutive_errors', sparse=True)
+        self.db.versions.ensure_index([('tracked_id', pymongo.ASCENDING),
+                                       ('timestamp', pymongo.ASCENDING)])
+        self.db.extracted_text.ensure_index('version_id')
+        self.db.versions.ensure_index([('snapshot_id', pymongo.ASCENDING),
+                                       ('chain', pymongo.ASCENDING)],
+                                      sparse=True)
 
-        self.scraper = scrapelib.Scraper(user_agent=user_agent,
-                                         requests_per_minute=rpm,
-                                         follow_robots=False,
-                                         raise_errors=True,
-                                         timeout=timeout)
+        self.scraper = LockedScraper(user_agent=user_agent,
+                                     requests_per_minute=rpm,
+                                     follow_robots=False,
+                                     raise_errors=True,
+                                     timeout=timeout)
 
         self.retry_attempts = retry_attempts
         self.retry_wait_minutes = retry_wait_minutes
 
+        # counters & histograms shared by all workers
+        self.metrics = Metrics(self.db, flush_seconds=metrics_flush_seconds)
+
+        # per-phase timing of updates, timing_hook(doc, timer) is called
+        # after each timed update
+        self.timing = timing
+        self.timing_hook = timing_hook
+        if timing:
+            self.db.update_stats.ensure_index('hour',
+                                              expireAfterSeconds=7 * 86400)
+
+        # per-host limits, shared across workers (doc_classes can override)
+        self.hosts = HostThrottle(self.db)
+        self.host_rpm = host_rpm
+        self.host_concurrency = host_concurrency
+
+        # used by doc_classes with stream=True
+        self.stream_chunk_bytes = stream_chunk_bytes
+        self.stream_spool_bytes = stream_spool_bytes
+
         # load engines
         self.storage = {}
         for name, StorageCls in engines.iteritems():
             self.storage[name] = StorageCls(self)
+        # cache of data read from storage, disabled if storage_cache_bytes=0
+        self.storage_cache = None
+        if storage_cache_bytes:
+            self.storage_cache = StorageCache(storage_cache_bytes,
+                                              storage_cache_dir,
+                                              storage_cache_dir_bytes,
+                                              self.metrics)
+
+        # deduplicating wrappers, for doc_classes with deduplicate=True
+        self.dedup_storage = {}
+        for name, storage in self.storage.iteritems():
+            self.dedup_storage[name] = DedupStorage(self, storage)
 
         # set document classes
         _doc_class_fields = ('update_mins', 'onchanged')
@@ -67,12 +159,38 @@ class Kernel(object):
             # set a default storage engine
             if 'storage_engine' not in dc_props:
                 dc_props['storage_engine'] = default_storage_engine
+            if dc_props.get('delta_interval') and dc_props.get('stream'):
+                raise ValueError('doc_class %s cannot use both stream and '
+                                 'delta_interval' % dc_name)
+            # deltas would overwrite their base if stored under the same key
+            storage = self.storage.get(dc_props['storage_engine'])
+            if (dc_props.get('delta_interval') and storage and
+                not dc_props.get('deduplicate') and
+                not getattr(storage, 'unique_keys', False)):
+                raise ValueError('doc_class %s needs deduplicate=True to use '
+                                 'delta_interval with %s storage' %
+                                 (dc_name, dc_props['storage_engine']))
+            codec = dc_props.get('compression')
+            if codec and codec not in compression.codecs:
+                raise ValueError('doc_class %s has unknown compression %s' %
+                                 (dc_name, codec))
+            if (dc_props.get('max_update_mins') and
+                dc_props.get('min_update_mins', dc_props['update_mins']) >
+                dc_props['max_update_mins']):
+                raise ValueError('doc_class %s has min_update_mins greater '
+                                 'than max_update_mins' % dc_name)
 
     def _wipe(self):
         """ exists primarily for debug use, wipes entire db """
         self.db.drop_collection('tracked')
+        self.db.drop_collection('versions')
         self.db.drop_collection('logs')
         self.db.drop_collection('status')
+        self.db.drop_collection('hosts')
+        self.db.drop_collection('blobs')
+        self.db.drop_collection('metrics')
+        self.db.drop_collection('update_stats')
+        self.db.drop_collection('extracted_text')
 
     def _add_doc_class(self, doc_class, **properties):
         self.doc_classes[doc_class] = properties
@@ -123,17 +241,183 @@ class Kernel(object):
 
         newdoc = dict(url=url, doc_class=doc_class,
                       _random=random.randint(0, sys.maxint),
-                      versions=[], metadata=kwargs)
+                      latest_version=None, version_count=0, metadata=kwargs)
         if id:
             newdoc['_id'] = id
         return self.db.tracked.insert(newdoc, safe=True)
 
+    def track_urls(self, specs, batch_size=1000):
+        """
+        Bulk version of track_url, same rules apply to each document.
+
+        specs
+            iterable of dicts with url, doc_class and optionally id and
+            metadata keys
+        batch_size
+            number of specs looked up & written per round-trip
+
+        Returns a list of (id, status) in the same order as specs, where
+        status is one of TRACK_CREATED, TRACK_UNCHANGED, TRACK_UPDATED or
+        TRACK_CONFLICT (id is None for conflicts).
+        """
+        results = []
+        batch = []
+        for spec in specs:
+            batch.append(spec)
+            if len(batch) == batch_size:
+                results.extend(self._track_batch(batch))
+                batch = []
+        if batch:
+            results.extend(self._track_batch(batch))
+        return results
+
+    def _track_batch(self, specs):
+        for spec in specs:
+            if spec['doc_class'] not in self.doc_classes:
+                error = 'error tracking %s, unregistered doc_class %s'
+                self.log.error(error, spec['url'], spec['doc_class'])
+                raise ValueError(error % (spec['url'], spec['doc_class']))
+
+        # look up all existing documents in two queries
+        ids = [spec['id'] for spec in specs if spec.get('id')]
+        urls = [spec['url'] for spec in specs if not spec.get('id')]
+        fields = ['url', 'doc_class', 'metadata']
+        by_id = {}
+        by_url = {}
+        if ids:
+            for doc in self.db.tracked.find({'_id': {'$in': ids}},
+                                            fields=fields):
+                by_id[doc['_id']] = doc
+        if urls:
+            for doc in self.db.tracked.find({'url': {'$in': urls}},
+                                            fields=fields):
+                by_url.setdefault(doc['url'], doc)
+
+        results = []
+        newdocs = []
+        metadata_updates = {}
+        for spec in specs:
+            url = spec['url']
+            doc_class = spec['doc_class']
+            id = spec.get('id')
+            metadata = spec.get('metadata') or {}
+            tracked = by_id.get(id) if id else by_url.get(url)
+
+            if not tracked:
+                newdoc = dict(url=url, doc_class=doc_class,
+                              _random=random.randint(0, sys.maxint),
+                              latest_version=None, version_count=0,
+                              metadata=metadata)
+                if id:
+                    newdoc['_id'] = id
+                else:
+                    newdoc['_id'] = bson.objectid.ObjectId()
+                newdocs.append(newdoc)
+                # later specs in this batch should see this document
+                if id:
+                    by_id[id] = newdoc
+                else:
+                    by_url[url] = newdoc
+                results.append((newdoc['_id'], TRACK_CREATED))
+            elif tracked['url'] == url and tracked['doc_class'] == doc_class:
+                if metadata != tracked['metadata']:
+                    tracked['metadata'] = metadata
+                    metadata_updates[tracked['_id']] = metadata
+                    results.append((tracked['_id'], TRACK_UPDATED))
+                else:
+                    results.append((tracked['_id'], TRACK_UNCHANGED))
+            else:
+                self.log.error('%s already exists with different data '
+                               '(tracked: %s, %s) (new: %s, %s)',
+                               tracked['_id'], tracked['url'],
+                               tracked['doc_class'], url, doc_class)
+                results.append((None, TRACK_CONFLICT))
+
+        if newdocs:
+            try:
+                self.db.tracked.insert(newdocs, safe=True,
+                                       continue_on_error=True)
+            except pymongo.errors.DuplicateKeyError:
+                # another process tracked some of these ids in the meantime,
+                # find the ones we didn't create and apply track_url's rules
+                results = self._resolve_duplicates(specs, results, newdocs)
+            self.log.info('tracked %s new documents', len(newdocs))
+
+        if metadata_updates:
+            self._update_metadata(metadata_updates)
+
+        return results
+
+    def _resolve_duplicates(self, specs, results, newdocs):
+        randoms = dict((doc['_id'], doc['_random']) for doc in newdocs)
+        created = set(doc['_id'] for doc in self.db.tracked.find(
+            {'_id': {'$in': randoms.keys()}}, fields=['_random'])
+            if doc['_random'] == randoms[doc['_id']])
+        resolved = []
+        for spec, (id, status) in zip(specs, results):
+            if status == TRACK_CREATED and id not in created:
+                metadata = spec.get('metadata') or {}
+                if spec.get('id'):
+                    existing = self.db.tracked.find_one({'_id': spec['id']},
+                                                        fields=['metadata'])
+                else:
+                    existing = self.db.tracked.find_one({'url': spec['url']},
+                                                        fields=['metadata'])
+                try:
+                    id = self.track_url(spec['url'], spec['doc_class'],
+                                        spec.get('id'), **metadata)
+                    # track_url rewrites metadata that doesn't match
+                    if existing and existing['metadata'] != metadata:
+                        status = TRACK_UPDATED
+                    else:
+                        status = TRACK_UNCHANGED
+                except ValueError:
+                    id, status = None, TRACK_CONFLICT
+            resolved.append((id, status))
+        return resolved
+
+    def _update_metadata(self, metadata_updates):
+        # bulk API is only available in pymongo >= 2.7
+        if hasattr(self.db.tracked, 'initialize_unordered_bulk_op'):
+            bulk = self.db.tracked.initialize_unordered_bulk_op()
+            for id, metadata in metadata_updates.iteritems():
+                bulk.find({'_id': id}).update({'$set': {'metadata': metadata}})
+            bulk.execute()
+        else:
+            for id, metadata in metadata_updates.iteritems():
+                self.db.tracked.update({'_id': id},
+                                       {'$set': {'metadata': metadata}},
+                                       safe=True)
+
+    def _conditional_headers(self, doc):
+        """
+        build If-None-Match/If-Modified-Since headers from the validators
+        stored on the most recent version (if any)
+        """
+        headers = {}
+        last = doc.get('latest_version')
+        if last:
+            if last.get('etag'):
+                headers['If-None-Match'] = last['etag']
+            if last.get('last_modified'):
+                headers['If-Modified-Since'] = last['last_modified']
+        return headers
+
     def md5_versioning(self, olddata, newdata):
         """ return True if md5 changed or if file is new """
         old_md5 = hashlib.md5(olddata).hexdigest()
         new_md5 = hashlib.md5(newdata).hexdigest()
         return old_md5 != new_md5
 
+    def version_md5(self, version):
+        """
+        md5 of a stored version, only hits storage for versions stored
+        before hashes were recorded
+        """
+        if version.get('md5'):
+            return version['md5']
+        return hashlib.md5(self.get_version_data(version)).hexdigest()
+
     def update(self, doc):
         """
         perform update upon a given document
@@ -146,9 +430,87 @@ class Kernel(object):
         * if error occured, log & keep track of how many errors in a row
         * update last_update/next_update timestamp
         """
+        timer = PhaseTimer() if self.timing else NULL_TIMER
+        if self._update(doc, timer):
+            self.db.tracked.save(doc, safe=True)
+            timer.mark('save')
+            if self.timing:
+                self._record_timing(doc, timer)
+
+    def update_many(self, docs, concurrency=10):
+        """
+        perform update upon many documents at once
+
+        fetches run in a pool of `concurrency` threads, the modified
+        documents are then written back to the database together
+        """
+        docs = list(docs)
+        pool = ThreadPool(concurrency)
+        try:
+            to_save = pool.map(self._update_or_log, docs)
+        finally:
+            pool.close()
+            pool.join()
+        self._save_many([doc for doc, save in zip(docs, to_save) if save])
+
+    def _update_or_log(self, doc):
+        """ _update that won't take down the rest of an update_many batch """
+        try:
+            timer = PhaseTimer() if self.timing else NULL_TIMER
+            saved = self._update(doc, timer)
+            if saved and self.timing:
+                # the save happens in bulk once the whole batch is done
+                self._record_timing(doc, timer)
+            return saved
+        except Exception:
+            self.log.exception('error updating %s [%s]', doc.get('url'),
+                               doc.get('_id'))
+            return False
+
+    def _save_many(self, docs):
+        if not docs:
+            return
+        # bulk API is only available in pymongo >= 2.7
+        if hasattr(self.db.tracked, 'initialize_unordered_bulk_op'):
+            bulk = self.db.tracked.initialize_unordered_bulk_op()
+            for doc in docs:
+                bulk.find({'_id': doc['_id']}).replace_one(doc)
+            bulk.execute()
+        else:
+            for doc in docs:
+                self.db.tracked.save(doc, safe=True)
+
+    def _record_timing(self, doc, timer):
+        """ log timings & add them to the hourly update_stats """
+        self.log.debug('timed %s [%s] %.3fs', doc['url'], doc['_id'],
+                       timer.total, extra={'timings': timer.durations,
+                                           'bytes': timer.bytes})
+        hour = datetime.datetime.utcnow().replace(minute=0, second=0,
+                                                  microsecond=0)
+        inc = {'count': 1}
+        for phase, seconds in timer.durations.iteritems():
+            inc['seconds.' + phase] = seconds
+        for phase, count in timer.bytes.iteritems():
+            inc['bytes.' + phase] = count
+        self.db.update_stats.update(
+            {'_id': '%s:%s' % (doc['doc_class'], hour.strftime('%Y%m%d%H'))},
+            {'$set': {'doc_class': doc['doc_class'], 'hour': hour},
+             '$inc': inc}, upsert=True)
+        if self.timing_hook:
+            self.timing_hook(doc, timer)
+
+    def _update(self, doc, timer=NULL_TIMER):
+        """
+        does the work of update() on doc in place, marking each phase on
+        timer
+
+        returns True if doc needs to be saved
+        """
 
         new_version = True
+        not_modified = False
         error = False
+        newdata = new_md5 = response_bytes = None
         now = datetime.datetime.utcnow()
 
         try:
@@ -157,32 +519,108 @@ class Kernel(object):
             raise ValueError('unregistered doc_class %s' % doc['doc_class'])
 
         update_mins = doc_class['update_mins']
-        storage = self.storage[doc_class['storage_engine']]
+        previous = doc.get('latest_version')
+        if doc_class.get('deduplicate'):
+            storage = self.dedup_storage[doc_class['storage_engine']]
+        else:
+            storage = self.storage[doc_class['storage_engine']]
+
+        url = doc['url'].replace(' ', '%20')
+
+        # wait our turn if this host is already busy
+        host = url_host(url)
+        host_rpm = doc_class.get('host_rpm', self.host_rpm)
+        host_concurrency = doc_class.get('host_concurrency',
+                                         self.host_concurrency)
+        host_token = None
+        if host_rpm or host_concurrency:
+            host_token = self.hosts.acquire(host, host_rpm, host_concurrency)
+            if not host_token:
+                self.metrics.inc('oyster_deferred_total', {'host': host})
+                self._defer(doc, now + self.hosts.retry_delay(host))
+                return False
+        timer.mark('setup')
 
         # fetch strategies could be implemented here as well
+        fetch_start = time.time()
         try:
-            url = doc['url'].replace(' ', '%20')
-            newdata = self.scraper.urlopen(url)
-            content_type = newdata.response.headers['content-type']
+            headers = self._conditional_headers(doc)
+            if doc_class.get('stream'):
+                response, newdata, new_md5 = self._fetch_to_file(url,
+                                                                 headers)
+            else:
+                response, newdata = self._fetch(url, headers)
+            if response.status_code == 304:
+                # validators matched, nothing to download or compare
+                new_version = False
+                not_modified = True
+            else:
+                content_type = response.headers['content-type']
+                if doc_class.get('stream'):
+                    newdata.seek(0, 2)
+                    response_bytes = newdata.tell()
+                    newdata.seek(0)
+                else:
+                    response_bytes = len(newdata)
         except Exception as e:
             new_version = False
             error = str(e)
+        finally:
+            if host_token:
+                self.hosts.release(host, host_token)
+        fetch_seconds = time.time() - fetch_start
+        timer.mark('fetch')
+        if response_bytes:
+            timer.add_bytes('fetch', response_bytes)
+
+        if new_version and not new_md5:
+            new_md5 = hashlib.md5(newdata).hexdigest()
+        timer.mark('hash')
 
         # only do versioning check if at least one version exists
-        if new_version and doc['versions']:
+        if new_version and doc.get('latest_version'):
             # room here for different versioning schemes
-            olddata = storage.get(doc['versions'][-1]['storage_key'])
-            new_version = self.md5_versioning(olddata, newdata)
+            new_version = self.version_md5(doc['latest_version']) != new_md5
+            if not new_version:
+                self._refresh_validators(doc, response)
+        timer.mark('version_check')
 
         if new_version:
-            storage_id = storage.put(doc, newdata, content_type)
-            doc['versions'].append({'timestamp': now,
-                                    'storage_key': storage_id,
-                                    'storage_type': storage.storage_type,
-                                   })
+            stored, delta_fields = self._delta_encode(doc, doc_class, newdata)
+            codec = doc_class.get('compression')
+            if codec:
+                level = doc_class.get('compression_level')
+                stored = compression.compress(stored, codec, level)
+            if isinstance(stored, str):
+                timer.add_bytes('put', len(stored))
+            storage_id = storage.put(doc, stored, content_type)
+            if codec and hasattr(stored, 'close'):
+                stored.close()
+            version = {'_id': bson.objectid.ObjectId(),
+                       'timestamp': now,
+                       'storage_key': storage_id,
+                       'storage_type': storage.storage_type,
+                       'compression': codec,
+                       'md5': new_md5,
+                       'etag': response.headers.get('etag'),
+                       'last_modified': response.headers.get('last-modified'),
+                      }
+            version.update(delta_fields)
+            # onchanged hooks are about to read this version
+            if self.storage_cache:
+                self.storage_cache.set(self._cache_key(version), newdata)
+            self.db.versions.insert(dict(version, tracked_id=doc['_id']),
+                                    safe=True)
+            doc['latest_version'] = version
+            doc['version_count'] = doc.get('version_count', 0) + 1
+            timer.mark('put')
             # fire off onchanged functions
             for onchanged in doc_class.get('onchanged', []):
                 send_task(onchanged, (doc['_id'],))
+            timer.mark('onchanged')
+
+        if doc_class.get('stream') and newdata:
+            newdata.close()
 
         if error:
             # if there's been an error, increment the consecutive_errors count
@@ -194,6 +632,10 @@ class Kernel(object):
         else:
             # reset error count if all was ok
             doc['consecutive_errors'] = 0
+            if update_mins and doc_class.get('max_update_mins'):
+                update_mins = self._adaptive_update_mins(doc, doc_class,
+                                                         new_version,
+                                                         previous, now)
 
         # last_update/next_update are separate from question of versioning
         doc['last_update'] = now
@@ -203,12 +645,178 @@ class Kernel(object):
             doc['next_update'] = None
 
         if error:
+            result = 'error'
             self.log.warning('error updating %s [%s]', url, doc['_id'])
+        elif not_modified:
+            result = 'not_modified'
+            self.log.info('updated %s [%s] (not modified)', url, doc['_id'])
         else:
-            new_version = ' (new)'
+            result = 'new' if new_version else 'unchanged'
+            new_version = ' (new)' if new_version else ''
             self.log.info('updated %s [%s]%s', url, doc['_id'], new_version)
 
-        self.db.tracked.save(doc, safe=True)
+        labels = {'doc_class': doc['doc_class']}
+        self.metrics.inc('oyster_updates_total', dict(labels, result=result))
+        self.metrics.observe('oyster_fetch_seconds', fetch_seconds, labels)
+        if response_bytes is not None:
+            self.metrics.observe('oyster_response_bytes', response_bytes,
+                                 labels)
+        if error:
+            self.metrics.inc('oyster_fetch_errors_total',
+                             dict(labels, host=host))
+
+        # back in the update queue once next_update passes
+        doc['lease_until'] = None
+        doc.pop('lease_token', None)
+        timer.mark('finish')
+        return True
+
+    def _refresh_validators(self, doc, response):
+        """
+        keep the latest version's validators current when a server changes
+        them without changing the content, otherwise it won't answer 304
+        """
+        latest = doc['latest_version']
+        validators = {'etag': response.headers.get('etag'),
+                      'last_modified': response.headers.get('last-modified')}
+        if all(latest.get(key) == value
+               for key, value in validators.iteritems()):
+            return
+        latest.update(validators)
+        self.db.versions.update({'_id': latest['_id']},
+                                {'$set': validators}, safe=True)
+
+    def _fetch(self, url, headers):
+        """
+        download url, sending headers
+
+        urlopen doesn't take headers in the scrapelib versions we support,
+        so this goes through the scraper's requests session instead
+
+        returns (response, raw bytes of the body)
+        """
+        response = self.scraper.request('GET', url, headers=headers)
+        self._check_response(response)
+        return response, response.content
+
+    def _check_response(self, response):
+        """ raise like urlopen does for responses the scraper rejects """
+        if not self.scraper.accept_response(response):
+            raise scrapelib.HTTPError(response)
+
+    def _fetch_to_file(self, url, headers):
+        """
+        download url in chunks, hashing as we go
+
+        the body is spooled to a temporary file (only kept in memory if it
+        is smaller than stream_spool_bytes) so large documents are never
+        held in memory all at once
+
+        returns (response, file, md5)
+        """
+        # prefetch=False leaves the body to be read by iter_content
+        response = self.scraper.request('GET', url, headers=headers,
+                                        prefetch=False)
+        self._check_response(response)
+        md5 = hashlib.md5()
+        spool = tempfile.SpooledTemporaryFile(max_size=self.stream_spool_bytes)
+        try:
+            for chunk in response.iter_content(self.stream_chunk_bytes):
+                md5.update(chunk)
+                spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        return response, spool, md5.hexdigest()
+
+    def _delta_encode(self, doc, doc_class, newdata):
+        """
+        for doc_classes with a delta_interval, store a delta against the
+        previous version unless a new snapshot is due (every delta_interval
+        versions) or the delta wouldn't be any smaller
+
+        returns (data to store, fields to set on the version)
+        """
+        interval = doc_class.get('delta_interval')
+        last = doc.get('latest_version')
+        if not interval or not last:
+            return newdata, {}
+        chain = last.get('chain', 0) + 1
+        if chain >= interval:
+            return newdata, {'chain': 0}
+        diff = delta.make_delta(self.get_version_data(last), newdata)
+        if len(diff) >= len(newdata):
+            return newdata, {'chain': 0}
+        return diff, {'chain': chain,
+                      'snapshot_id': last.get('snapshot_id', last['_id'])}
+
+    def _adaptive_update_mins(self, doc, doc_class, changed, previous, now):
+        """
+        minutes until the next update for doc_classes with max_update_mins
+
+        change_mins estimates the time between changes from the gaps between
+        versions and is raised by polls that find a document unchanged for
+        longer than that.  after a change documents are polled twice per
+        expected change, once overdue each unchanged poll backs off by
+        update_backoff, always within min_update_mins & max_update_mins
+        """
+        interval = doc.get('update_interval') or doc_class['update_mins']
+        estimate = doc.get('change_mins')
+        if previous:
+            # no timedelta.total_seconds() before 2.7
+            since = now - previous['timestamp']
+            since_change = (since.days * 1440 + since.seconds / 60. +
+                            since.microseconds / 6e7)
+
+        if changed and previous:
+            if estimate is None:
+                estimate = since_change
+            else:
+                weight = self.CHANGE_ESTIMATE_WEIGHT
+                estimate = weight * since_change + (1 - weight) * estimate
+            interval = estimate / 2
+        elif changed:
+            # first version, nothing to estimate from yet
+            interval = doc_class['update_mins']
+        elif estimate is None or since_change >= estimate:
+            interval *= doc_class.get('update_backoff', 2)
+            if estimate is not None:
+                estimate = since_change
+
+        interval = max(interval, doc_class.get('min_update_mins',
+                                               doc_class['update_mins']))
+        interval = min(interval, doc_class['max_update_mins'])
+        doc['change_mins'] = estimate
+        doc['update_interval'] = interval
+        return interval
+
+    def _defer(self, doc, next_update):
+        """ push back next_update without counting as an update attempt """
+        doc['next_update'] = next_update
+        doc['lease_until'] = None
+        self.db.tracked.update({'_id': doc['_id']},
+                               {'$set': {'next_update': next_update,
+                                         'lease_until': None},
+                                '$unset': {'lease_token': 1}})
+        self.log.debug('deferred %s [%s] until %s', doc['url'], doc['_id'],
+                       next_update)
+
+    def _update_queue_specs(self, now=None):
+        """
+        specs for documents that have never been retrieved and for those
+        that are stale, both excluding documents leased to a worker
+        """
+        now = now or datetime.datetime.utcnow()
+        unleased = {'lease_until': {'$not': {'$gt': now}}}
+        new = {'next_update': {'$exists': False}}
+        new.update(unleased)
+        stale = {'$and': [
+            {'next_update': {'$ne': None}},
+            {'next_update': {'$lt': now}},
+            unleased,
+        ]}
+        return new, stale
 
     def get_update_queue(self):
         """
@@ -220,19 +828,9 @@ class Kernel(object):
         server.
         """
         # results are always sorted by random to avoid piling on single server
-
-        # first we try to update anything that we've never retrieved
-        new = self.db.tracked.find({'next_update':
-                                    {'$exists': False}}).sort('_random')
-        queue = list(new)
-
-        # pull the rest from those for which next_update is in the past
-        next = self.db.tracked.find({'$and': [
-            {'next_update': {'$ne': None}},
-            {'next_update': {'$lt': datetime.datetime.utcnow()}},
-        ]}).sort('_random')
-        queue.extend(next)
-
+        queue = []
+        for spec in self._update_queue_specs():
+            queue.extend(self.db.tracked.find(spec).sort('_random'))
         return queue
 
     def get_update_queue_size(self):
@@ -240,30 +838,224 @@ class Kernel(object):
         Get the size of the update queue, this should match
         ``len(self.get_update_queue())``, but is computed more efficiently.
         """
-        new = self.db.tracked.find({'next_update': {'$exists': False}}).count()
-        next = self.db.tracked.find({'$and': [
-            {'next_update': {'$ne': None}},
-            {'next_update': {'$lt': datetime.datetime.utcnow()}},
-        ]}).count()
-        return new + next
+        return sum(self.db.tracked.find(spec).count() for spec in
+                   self._update_queue_specs())
+
+    def claim_update_queue(self, limit, lease_minutes=60):
+        """
+        Lease up to `limit` documents from the update queue, in
+        get_update_queue order, and return their ids.
+
+        Leased documents are left out of the update queue until updated or
+        until the lease expires, so concurrent schedulers never queue the
+        same document twice.  Only _ids are read so memory stays bounded.
+        """
+        now = datetime.datetime.utcnow()
+        ids = []
+        for spec in self._update_queue_specs(now):
+            if len(ids) >= limit:
+                break
+            cursor = self.db.tracked.find(spec, fields=['_id']).sort(
+                '_random').limit(limit - len(ids))
+            ids.extend(doc['_id'] for doc in cursor)
+
+        if not ids:
+            return []
+
+        # claim atomically, another scheduler may have claimed some already
+        token = bson.objectid.ObjectId()
+        lease_until = now + datetime.timedelta(minutes=lease_minutes)
+        self.db.tracked.update({'_id': {'$in': ids},
+                                'lease_until': {'$not': {'$gt': now}}},
+                               {'$set': {'lease_until': lease_until,
+                                         'lease_token': token}},
+                               multi=True, safe=True)
+        claimed = set(doc['_id'] for doc in self.db.tracked.find(
+            {'lease_token': token}, fields=['_id']))
+        return [id for id in ids if id in claimed]
+
+    def get_update_lag(self):
+        """
+        seconds the most overdue document is past its next_update
+        (0 if nothing is overdue)
+        """
+        now = datetime.datetime.utcnow()
+        for doc in self.db.tracked.find(
+            {'next_update': {'$ne': None, '$lt': now}},
+            fields=['next_update']).sort('next_update').limit(1):
+            lag = now - doc['next_update']
+            return lag.days * 86400 + lag.seconds + lag.microseconds / 1e6
+        return 0
+
+    def get_leased_count(self):
+        """ number of documents currently leased to workers """
+        return self.db.tracked.find({'lease_until': {
+            '$gt': datetime.datetime.utcnow()}}).count()
+
+    def refresh_status_summary(self):
+        """
+        recompute the counts shown on the dashboard (overall and per
+        doc_class) and store them in the status collection
+        """
+        now = datetime.datetime.utcnow()
+        new, stale = self._update_queue_specs(now)
+        errors = {'consecutive_errors': {'$gt': 0}}
+
+        def counts(extra):
+            return {
+                'tracking': self.db.tracked.find(extra).count(),
+                'need_update': sum(self.db.tracked.find(
+                    {'$and': [spec, extra]}).count() for spec in (new,
+                                                                  stale)),
+                'errors': self.db.tracked.find(
+                    {'$and': [errors, extra]}).count(),
+            }
+
+        summary = counts({})
+        summary.update(_id='summary', updated_at=now,
+                       leased=self.get_leased_count(),
+                       update_lag=self.get_update_lag(),
+                       doc_classes=[])
+        # doc_class names may contain dots, so they can't be keys
+        for name in sorted(self.doc_classes):
+            dc_counts = counts({'doc_class': name})
+            dc_counts['doc_class'] = name
+            summary['doc_classes'].append(dc_counts)
+
+        self.db.status.save(summary, safe=True)
+        return summary
+
+    def get_status_summary(self, max_age=300):
+        """
+        status summary from the status collection, recomputed if more than
+        max_age seconds old
+        """
+        summary = self.db.status.find_one({'_id': 'summary'})
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=max_age)
+        if not summary or summary['updated_at'] < cutoff:
+            summary = self.refresh_status_summary()
+        return summary
 
     def get_last_version(self, doc):
-        try:
-            doc_class = self.doc_classes[doc['doc_class']]
-        except KeyError:
+        if doc['doc_class'] not in self.doc_classes:
             raise ValueError('unregistered doc_class %s' % doc['doc_class'])
-        storage = self.storage[doc_class['storage_engine']]
-        return storage.get(doc['versions'][-1]['storage_key'])
+        return self.get_version_data(doc['latest_version'])
+
+    def get_version_data(self, version):
+        """ fetch the data for a version entry """
+        if self.storage_cache:
+            cache_key = self._cache_key(version)
+            data = self.storage_cache.get(cache_key)
+            if data is not None:
+                return data
+
+        if version.get('chain'):
+            data = self._reconstruct(version)
+        else:
+            data = self._get_stored_data(version)
+
+        if self.storage_cache:
+            self.storage_cache.set(cache_key, data)
+        return data
+
+    def _cache_key(self, version):
+        # storage keys can be reused by later versions, version ids can't
+        return str(version['_id'])
+
+    def get_version_data_at(self, doc, index):
+        """ fetch the data for a version by index, see get_version """
+        return self.get_version_data(self.get_version(doc, index))
+
+    def _reconstruct(self, version):
+        """
+        rebuild a delta-encoded version from its snapshot, applying at most
+        delta_interval - 1 deltas
+        """
+        snapshot = self.db.versions.find_one({'_id': version['snapshot_id']})
+        data = self._get_stored_data(snapshot)
+        deltas = self.db.versions.find({'snapshot_id': version['snapshot_id'],
+                                        'chain': {'$lte': version['chain']}}
+                                      ).sort('chain')
+        for entry in deltas:
+            data = delta.apply_delta(data, self._get_stored_data(entry))
+        return data
+
+    def _get_stored_data(self, version):
+        """ fetch data exactly as stored for version, decompressed """
+        storage = self.storage[version['storage_type']]
+        return compression.decompress(storage.get(version['storage_key']),
+                                      version.get('compression'))
+
+    def get_versions(self, doc):
+        """ cursor over all versions of doc, oldest first """
+        return self.db.versions.find({'tracked_id': doc['_id']}).sort(
+            'timestamp')
+
+    def get_version(self, doc, index):
+        """
+        get the version entry at index (0 is the oldest, negative indices
+        count back from the latest)
+        """
+        count = doc.get('version_count', 0)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('%s has no version %s' % (doc['_id'], index))
+        for version in self.get_versions(doc).skip(index).limit(1):
+            return version
+        raise IndexError('%s has no version %s' % (doc['_id'], index))
 
     def extract_text(self, doc):
-        version = self.get_last_version(doc)
+        """
+        text of the latest version of doc, as returned by the doc_class's
+        extract_text function
+
+        results are cached per version in the extracted_text collection,
+        bump the doc_class's extract_text_version to invalidate them when
+        the extract_text function changes
+        """
         doc_class = self.doc_classes[doc['doc_class']]
         try:
             extract_text = doc_class['extract_text']
         except KeyError:
             raise ValueError('doc_class %s missing extract_text' %
                              doc['doc_class'])
-        return extract_text(doc, version)
+
+        version_id = doc['latest_version']['_id']
+        extractor = doc_class.get('extract_text_version', 1)
+        cache_id = '%s:%s' % (version_id, extractor)
+        cached = self.db.extracted_text.find_one({'_id': cache_id})
+        if cached:
+            return self._decode_text(cached)
+
+        text = extract_text(doc, self.get_last_version(doc))
+        self._cache_text(cache_id, version_id, extractor, text)
+        return text
+
+    def _cache_text(self, cache_id, version_id, extractor, text):
+        cached = {'_id': cache_id, 'version_id': version_id,
+                  'extractor': extractor, 'text': None, 'unicode': False}
+        if text is not None:
+            if isinstance(text, unicode):
+                cached['unicode'] = True
+                text = text.encode('utf8')
+            cached['text'] = bson.binary.Binary(zlib.compress(text))
+            # too big for a mongo document, just extract again next time
+            if len(cached['text']) > self.MAX_CACHED_TEXT_BYTES:
+                return
+        self.db.extracted_text.save(cached)
+        # drop text from previous versions of the extractor
+        self.db.extracted_text.remove({'version_id': version_id,
+                                       'extractor': {'$ne': extractor}})
+
+    def _decode_text(self, cached):
+        if cached['text'] is None:
+            return None
+        text = zlib.decompress(cached['text'])
+        if cached['unicode']:
+            text = text.decode('utf8')
+        return text
 
 
 def _get_configured_kernel():
@@ -273,6 +1065,7 @@ def _get_configured_kernel():
                   mongo_port=settings.MONGO_PORT,
                   mongo_db=settings.MONGO_DATABASE,
                   mongo_log_maxsize=settings.MONGO_LOG_MAXSIZE,
+                  mongo_log_buffered=settings.MONGO_LOG_BUFFERED,
                   user_agent=settings.USER_AGENT,
                   rpm=settings.REQUESTS_PER_MINUTE,
                   timeout=settings.REQUEST_TIMEOUT,
@@ -280,6 +1073,16 @@ def _get_configured_kernel():
                   retry_wait_minutes=settings.RETRY_WAIT_MINUTES,
                   doc_classes=settings.DOCUMENT_CLASSES,
                   default_storage_engine=settings.DEFAULT_STORAGE_ENGINE,
+                  host_rpm=settings.HOST_REQUESTS_PER_MINUTE,
+                  host_concurrency=settings.HOST_CONCURRENCY,
+                  stream_chunk_bytes=settings.STREAM_CHUNK_BYTES,
+                  stream_spool_bytes=settings.STREAM_SPOOL_BYTES,
+                  storage_cache_bytes=settings.STORAGE_CACHE_BYTES,
+                  storage_cache_dir=settings.STORAGE_CACHE_DIR,
+                  storage_cache_dir_bytes=settings.STORAGE_CACHE_DIR_BYTES,
+                  metrics_flush_seconds=settings.METRICS_FLUSH_SECONDS,
+                  timing=settings.UPDATE_TIMING,
+                  timing_hook=getattr(settings, 'UPDATE_TIMING_HOOK', None),
                  )
 
 kernel = _get_configured_kernel()
@@ -1,6 +1,9 @@
 # needed so we can import cloudsearch
 from __future__ import absolute_import
 
+import json
+import hashlib
+
 from celery.task.base import Task
 
 from ..core import kernel
@@ -8,7 +11,11 @@ from ..conf import settings
 
 from cloudsearch import CloudSearch
 
-cs = CloudSearch(settings.CLOUDSEARCH_DOMAIN, settings.CLOUDSEARCH_ID, 20)
+# documents are sent to CloudSearch in SDF batches of this size
+BATCH_SIZE = getattr(settings, 'CLOUDSEARCH_BATCH_SIZE', 20)
+
+cs = CloudSearch(settings.CLOUDSEARCH_DOMAIN, settings.CLOUDSEARCH_ID,
+                 BATCH_SIZE)
 
 
 class CloudSearchPush(Task):
@@ -25,8 +32,32 @@ class CloudSearchPush(Task):
         pieces = [text[i:i+self.MAX_BYTES] for i in
                   xrange(0, len(text), self.MAX_BYTES)]
 
-        self.get_logger().debug('adding {0} pieces for {1}'.format(
-            len(pieces), doc_id))
-        for i, piece in enumerate(pieces):
+        # a piece needs uploading if its text or the metadata changed
+        metadata = json.dumps(doc['metadata'], sort_keys=True, default=str)
+        digests = []
+        for piece in pieces:
+            if isinstance(piece, unicode):
+                piece = piece.encode('utf8')
+            digests.append(hashlib.md5(piece + metadata).hexdigest())
+
+        # digests of the pieces uploaded last time
+        uploaded = kernel.db.cloudsearch_pieces.find_one({'_id': doc_id})
+        uploaded = uploaded['digests'] if uploaded else []
+
+        changed = [i for i, digest in enumerate(digests)
+                   if i >= len(uploaded) or uploaded[i] != digest]
+        stale = range(len(digests), len(uploaded))
+
+        self.get_logger().debug(
+            'adding {0} of {1} pieces, deleting {2} for {3}'.format(
+                len(changed), len(pieces), len(stale), doc_id))
+        for i in changed:
             cloud_id = '%s_%s' % (doc_id.lower(), i)
-            cs.add_document(cloud_id, text=piece, **doc['metadata'])
+            cs.add_document(cloud_id, text=pieces[i], **doc['metadata'])
+        for i in stale:
+            cs.delete_document('%s_%s' % (doc_id.lower(), i))
+
+        # digests may only be recorded once the pieces have really been sent,
+        # otherwise a lost batch would never be uploaded again
+        cs.flush()
+        kernel.db.cloudsearch_pieces.save({'_id': doc_id, 'digests': digests})
@@ -1,4 +1,7 @@
+import json
 import logging
+import datetime
+import urllib2
 from celery.task.base import Task
 
 from ..core import kernel
@@ -9,6 +12,11 @@ from pyes import ES
 es = ES(settings.ELASTICSEARCH_HOST)
 log = logging.getLogger('oyster.ext.elasticsearch')
 
+# ElasticSearchBulkPush sends a bulk request once either limit is reached
+BULK_DOCS = getattr(settings, 'ELASTICSEARCH_BULK_DOCS', 500)
+BULK_BYTES = getattr(settings, 'ELASTICSEARCH_BULK_BYTES', 10 * 1024 * 1024)
+
+
 class ElasticSearchPush(Task):
     # results go straight to elasticsearch
     ignore_result = True
@@ -34,3 +42,101 @@ class ElasticSearchPush(Task):
             log.warning('error tracking %s', doc_id,
                         extra={'doc_class':doc['doc_class']}, exc_info=True)
             raise
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    raise TypeError(repr(obj) + ' is not JSON serializable')
+
+
+def bulk_index(actions):
+    """
+    index many (doc_id, body) pairs with a single _bulk request
+
+    returns a dict of str(doc_id) -> error for documents that failed
+    """
+    lines = []
+    for doc_id, body in actions:
+        lines.append(json.dumps({'index': {
+            '_index': settings.ELASTICSEARCH_INDEX,
+            '_type': settings.ELASTICSEARCH_DOC_TYPE,
+            '_id': str(doc_id)}}))
+        lines.append(json.dumps(body, default=_json_default))
+
+    host = settings.ELASTICSEARCH_HOST
+    if not host.startswith('http'):
+        host = 'http://' + host
+    request = urllib2.Request(host.rstrip('/') + '/_bulk',
+                              '\n'.join(lines) + '\n')
+    response = json.load(urllib2.urlopen(request))
+
+    failed = {}
+    for item in response.get('items', []):
+        result = item.values()[0]
+        if result.get('error') or result.get('status', 200) >= 300:
+            failed[result['_id']] = result.get('error')
+    return failed
+
+
+class ElasticSearchBulkPush(Task):
+    """
+    pushes many documents using the bulk API
+
+    takes a list of ids, to reindex a doc_class use signal's --many:
+        signal oyster.ext.elasticsearch.ElasticSearchBulkPush <doc_class>
+            --many --chunk-size 500
+    """
+    # results go straight to elasticsearch
+    ignore_result = True
+
+    def run(self, doc_ids):
+        actions = []
+        size = 0
+        for doc in kernel.db.tracked.find({'_id': {'$in': doc_ids}}):
+            try:
+                text = kernel.extract_text(doc)
+            except Exception:
+                log.warning('error tracking %s', doc['_id'],
+                            extra={'doc_class':doc['doc_class']},
+                            exc_info=True)
+                continue
+            if not text:
+                log.info('no text for %s', doc['_id'],
+                         extra={'doc_class':doc['doc_class']})
+                continue
+
+            actions.append((doc, dict(doc['metadata'], text=text)))
+            size += len(text)
+            if len(actions) >= BULK_DOCS or size >= BULK_BYTES:
+                self.flush(actions)
+                actions = []
+                size = 0
+
+        if actions:
+            self.flush(actions)
+
+    def flush(self, actions):
+        try:
+            failed = bulk_index([(doc['_id'], body) for doc, body in actions])
+        except Exception:
+            log.warning('bulk request of %s documents failed', len(actions),
+                        exc_info=True)
+            failed = dict((str(doc['_id']), None) for doc, body in actions)
+
+        for doc, body in actions:
+            extra = {'doc_class': doc['doc_class']}
+            # ids come back from elasticsearch as strings
+            doc_id = str(doc['_id'])
+            if doc_id not in failed:
+                log.info('tracked %s', doc['_id'], extra=extra)
+                continue
+
+            # retry failures one at a time so each gets its own error
+            try:
+                es.index(body, settings.ELASTICSEARCH_INDEX,
+                         settings.ELASTICSEARCH_DOC_TYPE, id=doc['_id'])
+                log.info('tracked %s', doc['_id'], extra=extra)
+            except Exception:
+                log.warning('error tracking %s (bulk error: %s)', doc['_id'],
+                            failed[doc_id], extra=extra, exc_info=True)
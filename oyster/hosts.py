@@ -0,0 +1,71 @@
+"""
+    per-host politeness shared by all workers
+
+    each host gets a document in the `hosts` collection:
+        _id          : host name (lowercased netloc)
+        next_request : earliest time another request may start
+        active       : list of {token, expires} slots for in-flight requests
+
+    slots expire so that a worker dying mid-request can't block a host forever
+"""
+
+import datetime
+import urlparse
+
+import bson.objectid
+
+
+def url_host(url):
+    return urlparse.urlparse(url).netloc.lower()
+
+
+class HostThrottle(object):
+    """ enforces per-host requests per minute & concurrency via mongo """
+
+    def __init__(self, db, collection='hosts', lease_seconds=600):
+        self.collection = db[collection]
+        self.lease_seconds = lease_seconds
+
+    def acquire(self, host, rpm=None, max_concurrent=None):
+        """
+        try and claim a request slot for host
+
+        returns a token to pass to release() or None if the host is busy
+        """
+        now = datetime.datetime.utcnow()
+        token = bson.objectid.ObjectId()
+        expires = now + datetime.timedelta(seconds=self.lease_seconds)
+
+        # drop slots left behind by dead workers (creates host if missing)
+        self.collection.update({'_id': host},
+                               {'$pull': {'active': {'expires': {'$lt': now}}}},
+                               upsert=True)
+
+        spec = {'_id': host}
+        update = {'$push': {'active': {'token': token, 'expires': expires}}}
+        if rpm:
+            spec['$or'] = [{'next_request': {'$exists': False}},
+                           {'next_request': {'$lte': now}}]
+            update['$set'] = {'next_request':
+                              now + datetime.timedelta(minutes=1. / rpm)}
+        if max_concurrent:
+            # can only push if the array has fewer than max_concurrent slots
+            spec['active.%d' % (max_concurrent - 1)] = {'$exists': False}
+
+        if self.collection.find_and_modify(spec, update):
+            return token
+        return None
+
+    def release(self, host, token):
+        """ free a slot claimed with acquire() """
+        self.collection.update({'_id': host},
+                               {'$pull': {'active': {'token': token}}})
+
+    def retry_delay(self, host):
+        """ how long to wait before trying host again """
+        doc = self.collection.find_one({'_id': host}, fields=['next_request'])
+        now = datetime.datetime.utcnow()
+        if doc and doc.get('next_request') and doc['next_request'] > now:
+            return doc['next_request'] - now
+        # concurrency limited, try again shortly
+        return datetime.timedelta(seconds=30)
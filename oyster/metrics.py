@@ -0,0 +1,141 @@
+"""
+    counters & histograms aggregated across workers
+
+    each process accumulates values locally and periodically adds them to
+    the `metrics` collection with $inc, one document per metric & label set:
+        _id    : name{label="value",...}
+        name   : metric name
+        labels : dict of labels
+        type   : counter or histogram
+        value  : counter value
+        b0..bN : per-bucket histogram counts (not cumulative)
+        sum    : histogram sum
+        count  : histogram count
+"""
+
+import time
+import atexit
+import threading
+
+# upper bounds of histogram buckets
+HISTOGRAM_BUCKETS = {
+    'oyster_fetch_seconds': (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+    'oyster_response_bytes': (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9),
+}
+
+
+def _metric_id(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (k, _escape(v)) for k, v
+                                      in sorted(labels.iteritems())))
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+class Metrics(object):
+
+    def __init__(self, db, collection='metrics', flush_seconds=10):
+        self.collection = db[collection]
+        self.flush_seconds = flush_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        atexit.register(self.flush)
+
+    def _entry(self, name, labels, type):
+        key = _metric_id(name, labels)
+        entry = self._pending.get(key)
+        if not entry:
+            entry = self._pending[key] = {'name': name, 'labels': labels or {},
+                                          'type': type, 'inc': {}}
+        return entry['inc']
+
+    def inc(self, name, labels=None, value=1):
+        """ increment a counter """
+        with self._lock:
+            inc = self._entry(name, labels, 'counter')
+            inc['value'] = inc.get('value', 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, value, labels=None):
+        """ record value in a histogram """
+        buckets = HISTOGRAM_BUCKETS[name]
+        bucket = len(buckets)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                bucket = i
+                break
+        with self._lock:
+            inc = self._entry(name, labels, 'histogram')
+            field = 'b%d' % bucket
+            inc[field] = inc.get(field, 0) + 1
+            inc['sum'] = inc.get('sum', 0) + value
+            inc['count'] = inc.get('count', 0) + 1
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.time() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """ add locally accumulated values to the shared collection """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._last_flush = time.time()
+        for key, entry in pending.iteritems():
+            self.collection.update({'_id': key},
+                                   {'$set': {'name': entry['name'],
+                                             'labels': entry['labels'],
+                                             'type': entry['type']},
+                                    '$inc': entry['inc']},
+                                   upsert=True)
+
+    def render(self, gauges=None):
+        """
+        all metrics in Prometheus text exposition format
+
+        gauges is an optional dict of name -> value computed at render time
+        """
+        lines = []
+        by_name = {}
+        for doc in self.collection.find().sort('_id'):
+            by_name.setdefault(doc['name'], []).append(doc)
+
+        for name in sorted(by_name):
+            docs = by_name[name]
+            type = docs[0]['type']
+            lines.append('# TYPE %s %s' % (name, type))
+            for doc in docs:
+                labels = doc['labels']
+                if type == 'counter':
+                    lines.append('%s %s' % (_metric_id(name, labels),
+                                            _format_value(doc['value'])))
+                    continue
+                cumulative = 0
+                bounds = HISTOGRAM_BUCKETS[name]
+                for i, bound in enumerate(bounds + ('+Inf',)):
+                    cumulative += doc.get('b%d' % i, 0)
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append('%s %s' % (
+                        _metric_id(name + '_bucket', dict(labels, le=le)),
+                        cumulative))
+                lines.append('%s %s' % (_metric_id(name + '_sum', labels),
+                                        _format_value(doc['sum'])))
+                lines.append('%s %s' % (_metric_id(name + '_count', labels),
+                                        doc['count']))
+
+        for name, value in sorted((gauges or {}).iteritems()):
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %s' % (name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
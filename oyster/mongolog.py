@@ -4,11 +4,18 @@
     inspired by https://github.com/andreisavu/mongodb-log
 """
 
+import os
+import Queue
 import logging
 import datetime
 import socket
+import threading
+import time
 import pymongo
 
+# doesn't change for the life of the process
+HOSTNAME = socket.gethostname()
+
 
 class MongoFormatter(logging.Formatter):
 
@@ -21,7 +28,7 @@ class MongoFormatter(logging.Formatter):
             message=record.getMessage(),
             # overwrite created (float) w/ a mongo-compatible datetime
             created=datetime.datetime.utcnow(),
-            host=socket.gethostname(),
+            host=HOSTNAME,
             args=tuple(unicode(arg) for arg in record.args)
         )
         data.pop('msecs')   # not needed, stored in created
@@ -34,8 +41,20 @@ class MongoFormatter(logging.Formatter):
 
 
 class MongoHandler(logging.Handler):
+    """
+    writes log records to a (capped) mongo collection
+
+    with buffered=True records are queued and written in batches by a
+    background thread, whenever buffer_size records are waiting or
+    flush_interval seconds have passed.  At most max_queue records are
+    held, beyond that records are dropped (overflow='drop') or emit waits
+    for room (overflow='block').
+    """
+
     def __init__(self, db, collection='logs', host='localhost', port=None,
-                 capped_size=100000000, level=logging.NOTSET, async=True):
+                 capped_size=100000000, level=logging.NOTSET, async=True,
+                 buffered=False, buffer_size=100, flush_interval=1.0,
+                 max_queue=10000, overflow='drop'):
         db = pymongo.connection.Connection(host, port)[db]
         # try and create the capped log collection
         if capped_size:
@@ -48,7 +67,82 @@ class MongoHandler(logging.Handler):
         logging.Handler.__init__(self, level)
         self.formatter = MongoFormatter()
 
+        if overflow not in ('drop', 'block'):
+            raise ValueError('overflow must be drop or block')
+        self.buffered = buffered
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.dropped = 0
+        self._pid = None
+        if buffered:
+            self._start_writer()
+
+    def _start_writer(self):
+        # called again after a fork, threads don't survive it
+        self._pid = os.getpid()
+        self._queue = Queue.Queue(self.max_queue)
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='MongoHandler writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _write_loop(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        stop = False
+        while not stop:
+            try:
+                data = self._queue.get(timeout=max(deadline - time.time(), 0))
+                if data is None:
+                    stop = True
+                else:
+                    batch.append(data)
+            except Queue.Empty:
+                pass
+
+            if batch and (stop or len(batch) >= self.buffer_size or
+                          time.time() >= deadline):
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+                batch = []
+            if time.time() >= deadline:
+                deadline = time.time() + self.flush_interval
+            if stop:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            self.collection.insert(batch, safe=not self.async)
+        except Exception:
+            # nowhere safe to log this, don't take the writer down
+            pass
+
     def emit(self, record):
-        # explicitly set safe=False to get async insert
-        # TODO: what to do if an error occurs? not safe to log-- ignore?
-        self.collection.save(self.format(record), safe=not self.async)
+        if not self.buffered:
+            # explicitly set safe=False to get async insert
+            # TODO: what to do if an error occurs? not safe to log-- ignore?
+            self.collection.save(self.format(record), safe=not self.async)
+            return
+
+        if self._pid != os.getpid():
+            self._start_writer()
+        data = self.format(record)
+        try:
+            self._queue.put(data, block=(self.overflow == 'block'))
+        except Queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """ block until all queued records have been written """
+        if self.buffered and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        if self.buffered and self._pid == os.getpid() and \
+           self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        logging.Handler.close(self)
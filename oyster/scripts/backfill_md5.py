@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+import argparse
+import hashlib
+
+from oyster.core import kernel
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='record md5 hashes on versions stored without them',
+    )
+    parser.add_argument('--doc_class', type=str,
+                        help='only backfill documents in this doc_class')
+    args = parser.parse_args()
+
+    spec = {'md5': {'$exists': False}}
+    if args.doc_class:
+        ids = [doc['_id'] for doc in kernel.db.tracked.find(
+            {'doc_class': args.doc_class}, fields=['_id'])]
+        spec['tracked_id'] = {'$in': ids}
+
+    versions = kernel.db.versions.find(spec, timeout=False)
+    print '{0} versions missing hashes'.format(versions.count())
+
+    updated = 0
+    for version in versions:
+        md5 = hashlib.md5(kernel.get_version_data(version)).hexdigest()
+        # $set only the hashes so concurrent updates aren't clobbered
+        kernel.db.versions.update({'_id': version['_id']},
+                                  {'$set': {'md5': md5}})
+        kernel.db.tracked.update({'_id': version['tracked_id'],
+                                  'latest_version._id': version['_id']},
+                                 {'$set': {'latest_version.md5': md5}})
+        updated += 1
+        # don't sit on a connection
+        kernel.db.connection.end_request()
+
+    print 'recorded {0} hashes'.format(updated)
+
+if __name__ == '__main__':
+    main()
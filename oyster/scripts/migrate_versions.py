@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+import argparse
+
+from oyster.core import kernel
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='move embedded versions lists into versions collection',
+    )
+    parser.add_argument('--doc_class', type=str,
+                        help='only migrate documents in this doc_class')
+    args = parser.parse_args()
+
+    spec = {'versions': {'$exists': True}}
+    if args.doc_class:
+        spec['doc_class'] = args.doc_class
+
+    docs = kernel.db.tracked.find(spec, fields=['versions'], timeout=False)
+    print '{0} docs to migrate'.format(docs.count())
+
+    migrated = 0
+    for doc in docs:
+        for version in doc['versions']:
+            # upsert on (tracked_id, timestamp) so reruns don't duplicate
+            key = {'tracked_id': doc['_id'],
+                   'timestamp': version['timestamp']}
+            kernel.db.versions.update(key, {'$set': version}, upsert=True,
+                                      safe=True)
+
+        # versions may have been added by updates since the docs were read
+        versions = kernel.db.versions.find({'tracked_id': doc['_id']},
+                                           fields={'tracked_id': False})
+        count = versions.count()
+        latest = None
+        for latest in versions.sort('timestamp', -1).limit(1):
+            pass
+
+        kernel.db.tracked.update({'_id': doc['_id']},
+                                 {'$set': {'latest_version': latest,
+                                           'version_count': count},
+                                  '$unset': {'versions': 1}}, safe=True)
+        migrated += 1
+        # don't sit on a connection
+        kernel.db.connection.end_request()
+
+    print 'migrated {0} docs'.format(migrated)
+
+if __name__ == '__main__':
+    main()
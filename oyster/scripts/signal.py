@@ -1,11 +1,119 @@
 #!/usr/bin/env python
+import os
+import json
+import time
 import argparse
+import itertools
 import traceback
 import random
+import multiprocessing
 from celery.execute import send_task
 from celery import current_app
 
+import bson.objectid
+
 from oyster.core import kernel
+from oyster.tasks import chunked
+
+# set in each worker process by _init_worker
+_task = None
+
+
+def _load_task(name):
+    module, name = name.rsplit('.', 1)
+    return getattr(__import__(module, fromlist=[name]), name)
+
+
+def _init_worker(task_name):
+    global _task
+    _task = _load_task(task_name)
+
+
+def _apply(doc_id):
+    """
+    run the task on one document (or a list of them with --many),
+    returns (doc_id, error or None)
+    """
+    try:
+        _task.apply((doc_id,), throw=True)
+        return doc_id, None
+    except Exception:
+        return doc_id, traceback.format_exc()
+
+
+def read_checkpoint(filename):
+    """ last _id processed by a previous run, or None """
+    if not filename or not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        data = json.load(f)
+    if data['type'] == 'oid':
+        return bson.objectid.ObjectId(data['_id'])
+    return data['_id']
+
+
+def write_checkpoint(filename, doc_id):
+    data = {'_id': str(doc_id), 'type': 'str'}
+    if isinstance(doc_id, bson.objectid.ObjectId):
+        data['type'] = 'oid'
+    # write & rename so a crash can't leave a half-written checkpoint
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.rename(filename + '.tmp', filename)
+
+
+def run_immediate(args, doc_ids, total):
+    errors = 0
+    done = 0
+    start = last_report = time.time()
+    error_file = open(args.errors, 'a') if args.errors else None
+
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, _init_worker, (args.task,))
+        # imap keeps order so the checkpoint only ever moves past
+        # documents that have all been processed
+        results = pool.imap(_apply, doc_ids, chunksize=10)
+    else:
+        pool = None
+        _init_worker(args.task)
+        results = itertools.imap(_apply, doc_ids)
+
+    since_checkpoint = 0
+    try:
+        for item, error in results:
+            ids = item if args.many else [item]
+            done += len(ids)
+            since_checkpoint += len(ids)
+            if error:
+                errors += 1
+                if error_file:
+                    failed = map(str, ids) if args.many else str(item)
+                    error_file.write(json.dumps({'_id': failed,
+                                                 'error': error}) + '\n')
+                    error_file.flush()
+                else:
+                    print error
+
+            now = time.time()
+            if args.checkpoint and since_checkpoint >= 100:
+                write_checkpoint(args.checkpoint, ids[-1])
+                since_checkpoint = 0
+            if now - last_report >= args.progress:
+                last_report = now
+                print '{0}/{1} docs, {2:.1f} docs/s, {3} errors'.format(
+                    done, total, done / (now - start), errors)
+    finally:
+        if pool:
+            pool.terminate()
+        if error_file:
+            error_file.close()
+
+    if args.checkpoint and done:
+        write_checkpoint(args.checkpoint, ids[-1])
+    elapsed = time.time() - start
+    print '{0} errors in {1} documents ({2:.1f} docs/s)'.format(
+        errors, done, done / elapsed if elapsed else 0)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -17,37 +125,55 @@ def main():
                         help='doc_class to apply function to')
     parser.add_argument('--sample', action='store_true')
     parser.add_argument('--immediate', action='store_true')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes to run immediate tasks in')
+    parser.add_argument('--checkpoint', type=str,
+                        help='file recording progress, resumes from it')
+    parser.add_argument('--errors', type=str,
+                        help='append errors to this file (as JSON lines)')
+    parser.add_argument('--progress', type=float, default=10,
+                        help='seconds between progress reports')
+    parser.add_argument('--chunk-size', type=int, default=1,
+                        help='send ids to workers this many per message')
+    parser.add_argument('--many', action='store_true',
+                        help='task takes a list of ids (e.g. '
+                        'ElasticSearchBulkPush), pass it whole chunks')
 
     args = parser.parse_args()
 
-    docs = kernel.db.tracked.find({'doc_class': args.doc_class,
-                                   'versions': {'$ne': []}
-                                  }, timeout=False)
+    spec = {'doc_class': args.doc_class, 'version_count': {'$gt': 0}}
+    last_id = read_checkpoint(args.checkpoint)
+    if last_id is not None:
+        print 'resuming after {0}'.format(last_id)
+        spec['_id'] = {'$gt': last_id}
+
+    docs = kernel.db.tracked.find(spec, fields=['_id'],
+                                  timeout=False).sort('_id')
     total = docs.count()
     print '{0} docs in {1}'.format(total, args.doc_class)
 
     if args.sample:
         limit = 100
         print 'sampling {0} documents'.format(limit)
-        docs = docs.limit(limit).skip(random.randint(0, total-limit))
+        docs = docs.limit(limit).skip(random.randint(0, max(total-limit, 0)))
+        total = min(total, limit)
         args.immediate = True
 
-    errors = 0
+    doc_ids = (doc['_id'] for doc in docs)
 
     if args.immediate:
-        module, name = args.task.rsplit('.', 1)
-        task = getattr(__import__(module, fromlist=[name]), name)
-        for doc in docs:
-            try:
-                task.apply((doc['_id'],), throw=True)
-            except Exception:
-                errors += 1
-                traceback.print_exc()
-        print '{0} errors in {1} documents'.format(errors, total)
-
+        if args.many:
+            doc_ids = chunked(doc_ids, args.chunk_size)
+        run_immediate(args, doc_ids, total)
+    elif args.many:
+        for chunk in chunked(doc_ids, args.chunk_size):
+            send_task(args.task, (chunk, ))
+    elif args.chunk_size > 1:
+        for chunk in chunked(doc_ids, args.chunk_size):
+            send_task('oyster.tasks.ChunkTask', (args.task, chunk))
     else:
-        for doc in docs:
-            send_task(args.task, (doc['_id'], ))
+        for doc_id in doc_ids:
+            send_task(args.task, (doc_id, ))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import argparse
+import csv
+import json
+import itertools
+from collections import Counter
+
+from oyster.core import kernel
+
+
+def csv_specs(f, doc_class):
+    """ url,doc_class,id columns, any other columns become metadata """
+    for row in csv.DictReader(f):
+        spec = {'url': row.pop('url'),
+                'doc_class': row.pop('doc_class', None) or doc_class,
+                'id': row.pop('id', None) or None}
+        spec['metadata'] = dict((k, v) for k, v in row.iteritems() if v)
+        yield spec
+
+
+def jsonl_specs(f, doc_class):
+    """ one object per line with url, doc_class, id & metadata keys """
+    for line in f:
+        line = line.strip()
+        if line:
+            spec = json.loads(line)
+            spec.setdefault('doc_class', doc_class)
+            yield spec
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='track all URLs listed in a CSV or JSONL file',
+    )
+
+    parser.add_argument('filename', type=str,
+                        help='.csv or .jsonl file of documents to track')
+    parser.add_argument('--doc_class', type=str,
+                        help='doc_class for rows that do not specify one')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='file format (default: guess from extension)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.filename.endswith('.csv')
+                          else 'jsonl')
+    reader = csv_specs if fmt == 'csv' else jsonl_specs
+
+    totals = Counter()
+    with open(args.filename) as f:
+        specs = reader(f, args.doc_class)
+        while True:
+            batch = list(itertools.islice(specs, args.batch_size))
+            if not batch:
+                break
+            results = kernel.track_urls(batch, batch_size=args.batch_size)
+            for spec, (id, status) in zip(batch, results):
+                totals[status] += 1
+                if id is None:
+                    print 'conflict: {0}'.format(spec['url'])
+            print '{0} processed'.format(sum(totals.values()))
+
+    print ', '.join('{0} {1}'.format(n, status) for status, n in
+                    sorted(totals.items()))
+
+if __name__ == '__main__':
+    main()
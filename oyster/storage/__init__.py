@@ -17,3 +17,9 @@ try:
     engines['gridfs'] = GridFSStorage
 except ImportError:
     pass
+
+try:
+    from .filesystem import FileSystemStorage
+    engines['filesystem'] = FileSystemStorage
+except ImportError:
+    pass
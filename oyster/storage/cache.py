@@ -0,0 +1,161 @@
+"""
+    byte-bounded LRU cache for data read from storage
+
+    entries are kept in memory up to max_bytes, if spill_dir is set they are
+    also written there so that other workers on the same host can read them
+
+    hits, misses & evictions are also counted in metrics (if given) so that
+    the cache can be sized from /metrics
+"""
+
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class StorageCache(object):
+
+    def __init__(self, max_bytes, spill_dir=None, spill_max_bytes=None,
+                 metrics=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.metrics = metrics
+        self._entries = OrderedDict()
+        self._size = 0
+        self._spilled_since_prune = 0
+        # update_many reads from several threads
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if spill_dir and not os.path.isdir(spill_dir):
+            try:
+                os.makedirs(spill_dir)
+            except OSError:
+                if not os.path.isdir(spill_dir):
+                    raise
+
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self._size}
+
+    def get(self, key):
+        """ cached data for key or None """
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                # reinsert as most recently used
+                self._entries[key] = data
+                self.hits += 1
+        if data is not None:
+            self._count('oyster_storage_cache_hits_total', {'tier': 'memory'})
+            return data
+
+        data = self._read_spill(key)
+        if data is None:
+            self.misses += 1
+            self._count('oyster_storage_cache_misses_total')
+            return None
+        self.disk_hits += 1
+        self._count('oyster_storage_cache_hits_total', {'tier': 'disk'})
+        self._remember(key, data)
+        return data
+
+    def _count(self, name, labels=None, value=1):
+        if self.metrics and value:
+            self.metrics.inc(name, labels, value)
+
+    def set(self, key, data):
+        # mmaps & file objects aren't worth copying into memory
+        if not isinstance(data, str):
+            return
+        if type(data) is not str:
+            data = str(data)
+        if len(data) > self.max_bytes:
+            return
+        self._remember(key, data)
+        if self.spill_dir:
+            self._write_spill(key, data)
+
+    def _remember(self, key, data):
+        evictions = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                evictions += 1
+            self.evictions += evictions
+        # outside the lock, metrics may write to the database
+        self._count('oyster_storage_cache_evictions_total', value=evictions)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.md5(key).hexdigest())
+
+    def _read_spill(self, key):
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        # mtime tracks recent use for pruning
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def _write_spill(self, key, data):
+        path = self._spill_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # rename so other workers never see a partial file, replacing any
+        # older data stored under key
+        os.rename(tmp_path, path)
+
+        if self.spill_max_bytes:
+            self._spilled_since_prune += len(data)
+            if self._spilled_since_prune > self.spill_max_bytes / 10:
+                self._spilled_since_prune = 0
+                self._prune_spill()
+
+    def _prune_spill(self):
+        """ remove least recently used spill files until under budget """
+        files = []
+        total = 0
+        for name in os.listdir(self.spill_dir):
+            if name.startswith('.tmp-'):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # removed by another worker
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.spill_max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,52 @@
+"""
+    compression applied to stored data, independent of storage engine
+
+    the codec is recorded on each version so that versions stored before
+    compression was enabled (or with a different codec) still read back
+"""
+
+import bz2
+import zlib
+import tempfile
+
+
+def _zlib_compressor(level):
+    return zlib.compressobj(level)
+
+
+def _bz2_compressor(level):
+    return bz2.BZ2Compressor(level)
+
+
+# name -> (compressor factory, decompress function, default level)
+codecs = {
+    'zlib': (_zlib_compressor, zlib.decompress, 6),
+    'bz2': (_bz2_compressor, bz2.decompress, 9),
+}
+
+
+def compress(data, codec, level=None):
+    """
+    compress data (string or file-like object) with codec
+
+    file-like objects are compressed in chunks into a new temporary file
+    """
+    make_compressor, _, default_level = codecs[codec]
+    if level is None:
+        level = default_level
+    compressor = make_compressor(level)
+    if not hasattr(data, 'read'):
+        return compressor.compress(data) + compressor.flush()
+
+    out = tempfile.SpooledTemporaryFile(max_size=1048576)
+    for chunk in iter(lambda: data.read(65536), ''):
+        out.write(compressor.compress(chunk))
+    out.write(compressor.flush())
+    out.seek(0)
+    return out
+
+
+def decompress(data, codec):
+    if not codec:
+        return data
+    return codecs[codec][1](data)
@@ -0,0 +1,52 @@
+import hashlib
+
+import pymongo
+
+
+class DedupStorage(object):
+    """
+    wraps another storage engine so that identical data is only stored once
+
+    blobs are keyed by sha256 digest in the `blobs` collection which counts
+    how many versions reference each one
+    """
+
+    def __init__(self, kernel, engine):
+        self.engine = engine
+        self.storage_type = engine.storage_type
+        self.blobs = kernel.db.blobs
+
+    def _digest(self, data):
+        sha = hashlib.sha256()
+        if hasattr(data, 'read'):
+            for chunk in iter(lambda: data.read(65536), ''):
+                sha.update(chunk)
+            data.seek(0)
+        else:
+            sha.update(data)
+        return sha.hexdigest()
+
+    def put(self, tracked_doc, data, content_type):
+        digest = self._digest(data)
+        blob_id = '%s:%s' % (self.storage_type, digest)
+
+        blob = self.blobs.find_and_modify({'_id': blob_id},
+                                          {'$inc': {'refs': 1}})
+        if blob:
+            return blob['storage_key']
+
+        # store under the digest so the blob isn't tied to one document
+        key = self.engine.put(dict(tracked_doc, _id=digest), data,
+                              content_type)
+        try:
+            self.blobs.insert({'_id': blob_id, 'storage_key': key,
+                               'refs': 1}, safe=True)
+        except pymongo.errors.DuplicateKeyError:
+            # stored concurrently by another worker, use theirs
+            blob = self.blobs.find_and_modify({'_id': blob_id},
+                                              {'$inc': {'refs': 1}})
+            key = blob['storage_key']
+        return key
+
+    def get(self, id):
+        return self.engine.get(id)
@@ -0,0 +1,69 @@
+"""
+    line-based deltas between versions of a document
+
+    a delta is a sequence of operations applied to the previous version:
+        C <start> <end>     copy bytes [start, end) of the previous version
+        I <length> <bytes>  insert new bytes
+    with integers packed as unsigned 32-bit big endian
+"""
+
+import struct
+import difflib
+
+MAGIC = 'ODLT1'
+_COPY = 'C'
+_INSERT = 'I'
+_INT = struct.Struct('>I')
+_RANGE = struct.Struct('>II')
+
+
+def make_delta(old, new):
+    """ build a delta that turns old into new """
+    old = old[:]
+    new = new[:]
+    if isinstance(old, unicode) or isinstance(new, unicode):
+        # ops are packed bytes, decoded text can't be mixed in
+        raise TypeError('deltas can only be made between byte strings')
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+
+    # byte offset of the start of each line (plus end of data)
+    offsets = [0]
+    for line in old_lines:
+        offsets.append(offsets[-1] + len(line))
+
+    ops = [MAGIC]
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines,
+                                      autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(_COPY + _RANGE.pack(offsets[i1], offsets[i2]))
+        elif j2 > j1:
+            # replace & insert both become inserts, deletes are implicit
+            inserted = ''.join(new_lines[j1:j2])
+            ops.append(_INSERT + _INT.pack(len(inserted)) + inserted)
+    return ''.join(ops)
+
+
+def apply_delta(old, delta):
+    """ apply a delta created by make_delta to old """
+    if delta[:len(MAGIC)] != MAGIC:
+        raise ValueError('not an oyster delta')
+    pieces = []
+    pos = len(MAGIC)
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op == _COPY:
+            start, stop = _RANGE.unpack_from(delta, pos)
+            pos += _RANGE.size
+            pieces.append(old[start:stop])
+        elif op == _INSERT:
+            length, = _INT.unpack_from(delta, pos)
+            pos += _INT.size
+            pieces.append(delta[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError('corrupt delta, unknown op %r' % op)
+    return ''.join(pieces)
@@ -8,6 +8,8 @@ class DummyStorage(object):
 
     def put(self, tracked_doc, data, content_type):
         """ store the document in local dict """
+        if hasattr(data, 'read'):
+            data = data.read()
         self._storage[tracked_doc['_id']] = data
         return tracked_doc['_id']
 
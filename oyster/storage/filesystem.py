@@ -0,0 +1,74 @@
+import os
+import mmap
+import uuid
+import tempfile
+
+from oyster.conf import settings
+
+
+class FileSystemStorage(object):
+    """
+    stores documents as files beneath FILESYSTEM_STORAGE_ROOT
+
+    keys are random hex strings, files are sharded into two levels of
+    directories by the first four characters of the key
+    """
+
+    storage_type = 'filesystem'
+    # every put gets a new key
+    unique_keys = True
+
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.root = settings.FILESYSTEM_STORAGE_ROOT
+        self.fsync = settings.FILESYSTEM_STORAGE_FSYNC
+
+    def _path(self, id):
+        return os.path.join(self.root, id[:2], id[2:4], id)
+
+    def put(self, tracked_doc, data, content_type):
+        """ write the document to a temp file & rename into place """
+        id = uuid.uuid4().hex
+        path = self._path(id)
+        dirname = os.path.dirname(path)
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(data, 'read'):
+                    for chunk in iter(lambda: data.read(65536), ''):
+                        f.write(chunk)
+                else:
+                    f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        if self.fsync:
+            # make the rename itself durable
+            dirfd = os.open(dirname, os.O_RDONLY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
+        return id
+
+    def get(self, id):
+        """
+        returns a read-only mmap of the file, slice it (``data[:]``) if an
+        actual string is needed
+        """
+        with open(self._path(id), 'rb') as f:
+            # can't mmap an empty file
+            if not os.fstat(f.fileno()).st_size:
+                return ''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
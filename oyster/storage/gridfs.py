@@ -5,6 +5,8 @@ import gridfs
 
 class GridFSStorage(object):
     storage_type = 'gridfs'
+    # every put gets a new key
+    unique_keys = True
 
     def __init__(self, kernel):
         self.db = kernel.db
@@ -12,6 +14,7 @@ class GridFSStorage(object):
         self.fs = gridfs.GridFS(self.db, self._collection_name)
 
     def put(self, tracked_doc, data, content_type):
+        # GridFS.put accepts strings and file-like objects
         return self.fs.put(data, filename=tracked_doc['url'],
                            content_type=content_type,
                            **tracked_doc['metadata'])
@@ -1,8 +1,16 @@
+import os
 import urllib
 import boto
 from oyster.conf import settings
 
 
+# file objects larger than this are sent as a multipart upload in parts of
+# MULTIPART_CHUNK_BYTES (S3 requires parts of at least 5MB)
+MULTIPART_BYTES = getattr(settings, 'S3_MULTIPART_BYTES', 100 * 1024 * 1024)
+MULTIPART_CHUNK_BYTES = getattr(settings, 'S3_MULTIPART_CHUNK_BYTES',
+                                50 * 1024 * 1024)
+
+
 class S3Storage(object):
     storage_type = 's3'
 
@@ -31,12 +39,38 @@ class S3Storage(object):
         k.key = key_name
         headers = {'x-amz-acl': 'public-read',
                    'Content-Type': content_type}
-        k.set_contents_from_string(data, headers=headers)
+        if hasattr(data, 'read'):
+            data.seek(0, os.SEEK_END)
+            size = data.tell()
+            data.seek(0)
+            if size > MULTIPART_BYTES:
+                self._multipart_upload(key_name, data, size, headers)
+            else:
+                k.set_contents_from_file(data, headers=headers)
+        else:
+            k.set_contents_from_string(data, headers=headers)
         # can also set metadata if we want, useful?
 
         url = 'http://%s.s3.amazonaws.com/%s' % (aws_bucket, key_name)
         return url
 
+    def _multipart_upload(self, key_name, data, size, headers):
+        """ single PUTs are limited to 5GB, send big files in parts """
+        upload = self.bucket.initiate_multipart_upload(key_name,
+                                                       headers=headers)
+        try:
+            part_num = 1
+            while data.tell() < size:
+                upload.upload_part_from_file(
+                    data, part_num,
+                    size=min(MULTIPART_CHUNK_BYTES, size - data.tell()))
+                part_num += 1
+        except Exception:
+            # don't leave orphaned parts around to be billed for
+            upload.cancel_upload()
+            raise
+        upload.complete_upload()
+
     def get(self, id):
         # could use get_contents_as_string, any advantages?
         return urllib.urlopen(id).read()
@@ -1,6 +1,8 @@
 from celery.task.base import Task, PeriodicTask
 from celery.execute import send_task
+from celery import current_app
 
+from oyster.conf import settings
 from oyster.core import kernel
 
 
@@ -11,12 +13,52 @@ class UpdateTask(Task):
 
     def run(self, doc_id):
         doc = kernel.db.tracked.find_one({'_id': doc_id})
-        kernel.db.status.update({}, {'$inc': {'update_queue': -1}})
         kernel.update(doc)
         # don't sit on a connection
         kernel.db.connection.end_request()
 
 
+def chunked(iterable, size):
+    """ yield lists of up to size items from iterable """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ChunkTask(Task):
+    """ task that applies the task named task_name to each of doc_ids """
+    # results go straight to database
+    ignore_result = True
+
+    def run(self, task_name, doc_ids):
+        task = current_app.tasks[task_name]
+        logger = self.get_logger()
+        for doc_id in doc_ids:
+            # one bad document shouldn't fail the rest of the chunk
+            try:
+                task.run(doc_id)
+            except Exception:
+                logger.exception('{0} failed on {1}'.format(task_name,
+                                                            doc_id))
+
+
+class UpdateManyTask(Task):
+    """ task that updates a batch of documents concurrently """
+    # results go straight to database
+    ignore_result = True
+
+    def run(self, doc_ids):
+        docs = list(kernel.db.tracked.find({'_id': {'$in': doc_ids}}))
+        kernel.update_many(docs, concurrency=settings.UPDATE_CONCURRENCY)
+        # don't sit on a connection
+        kernel.db.connection.end_request()
+
+
 class UpdateTaskScheduler(PeriodicTask):
     """ recurring task that populates the update queue """
 
@@ -25,23 +67,40 @@ class UpdateTaskScheduler(PeriodicTask):
     ignore_result = True
 
     def run(self):
-        # if the update queue isn't empty, wait to add more
-        # (currently the only way we avoid duplicates)
-        # alternate option would be to set a _queued flag on documents
-        update_queue_size = kernel.db.status.find_one()['update_queue']
-        if update_queue_size:
-            self.get_logger().debug('waiting, update_queue_size={0}'.format(
-                                    update_queue_size))
+        # documents are leased when queued so they can't be queued twice,
+        # top the queue up to UPDATE_QUEUE_SIZE outstanding documents
+        leased = kernel.get_leased_count()
+        room = settings.UPDATE_QUEUE_SIZE - leased
+        if room <= 0:
+            self.get_logger().debug('waiting, {0} documents queued'.format(
+                                    leased))
             return
 
-        next_set = kernel.get_update_queue()
+        next_set = kernel.claim_update_queue(
+            room, lease_minutes=settings.UPDATE_LEASE_MINUTES)
         if next_set:
-            self.get_logger().debug('repopulating update_queue')
+            self.get_logger().debug('queueing {0} documents'.format(
+                                    len(next_set)))
         else:
             self.get_logger().debug('kernel.update_queue empty')
 
-        for doc in next_set:
-            UpdateTask.delay(doc['_id'])
-            kernel.db.status.update({}, {'$inc': {'update_queue': 1}})
-            # don't sit on a connection
-            kernel.db.connection.end_request()
+        if settings.UPDATE_CHUNK_SIZE > 1:
+            for chunk in chunked(next_set, settings.UPDATE_CHUNK_SIZE):
+                UpdateManyTask.delay(chunk)
+        else:
+            for doc_id in next_set:
+                UpdateTask.delay(doc_id)
+        # don't sit on a connection
+        kernel.db.connection.end_request()
+
+
+class StatusSummaryTask(PeriodicTask):
+    """ recurring task that refreshes the dashboard's status summary """
+
+    run_every = settings.STATUS_SUMMARY_SECONDS
+    ignore_result = True
+
+    def run(self):
+        kernel.refresh_status_summary()
+        # don't sit on a connection
+        kernel.db.connection.end_request()
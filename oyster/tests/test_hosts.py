@@ -0,0 +1,49 @@
+import time
+import unittest
+
+import pymongo
+from ..hosts import HostThrottle, url_host
+
+
+class TestHostThrottle(unittest.TestCase):
+
+    DB_NAME = 'oyster_test'
+
+    def setUp(self):
+        pymongo.Connection().drop_database(self.DB_NAME)
+        self.throttle = HostThrottle(pymongo.Connection()[self.DB_NAME])
+
+    def tearDown(self):
+        pymongo.Connection().drop_database(self.DB_NAME)
+
+    def test_url_host(self):
+        self.assertEqual(url_host('http://Example.com/a/b?c=d'),
+                         'example.com')
+
+    def test_concurrency(self):
+        first = self.throttle.acquire('example.com', max_concurrent=2)
+        second = self.throttle.acquire('example.com', max_concurrent=2)
+        self.assertTrue(first and second)
+        # third request must wait
+        self.assertEqual(self.throttle.acquire('example.com',
+                                               max_concurrent=2), None)
+        # other hosts are unaffected
+        self.assertTrue(self.throttle.acquire('example.org', max_concurrent=2))
+
+        self.throttle.release('example.com', first)
+        self.assertTrue(self.throttle.acquire('example.com', max_concurrent=2))
+
+    def test_expired_slots(self):
+        self.throttle.lease_seconds = -1
+        self.assertTrue(self.throttle.acquire('example.com', max_concurrent=1))
+        # slot expired immediately, so another worker can claim it
+        self.assertTrue(self.throttle.acquire('example.com', max_concurrent=1))
+
+    def test_rpm(self):
+        # 120 rpm = one request every 0.5s
+        token = self.throttle.acquire('example.com', rpm=120)
+        self.throttle.release('example.com', token)
+        self.assertEqual(self.throttle.acquire('example.com', rpm=120), None)
+        self.assertTrue(self.throttle.retry_delay('example.com').seconds < 1)
+        time.sleep(0.5)
+        self.assertTrue(self.throttle.acquire('example.com', rpm=120))
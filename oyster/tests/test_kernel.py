@@ -1,15 +1,78 @@
 import time
 import datetime
+import hashlib
+import threading
+import BaseHTTPServer
 from unittest import TestCase
 
 from nose.tools import assert_raises, assert_equal
+from bson.objectid import ObjectId
 
-from oyster.core import Kernel
+from oyster.core import (Kernel, TRACK_CREATED, TRACK_UNCHANGED,
+                         TRACK_UPDATED, TRACK_CONFLICT)
+from oyster.storage.cache import StorageCache
+
+
+extract_calls = []
+
+
+def extract_upper(doc, data):
+    extract_calls.append(doc['_id'])
+    return data.upper()
 
 
 def hook_fired(doc, newdata):
     doc['hook_fired'] = doc.get('hook_fired', 0) + 1
 
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    serves server.pages, a dict of path -> {status, body, headers}
+    answering If-None-Match with a 304 when it matches the ETag
+    """
+
+    def do_GET(self):
+        self.server.requests.append(self.headers)
+        page = self.server.pages.get(self.path, {'status': 404, 'body': ''})
+        headers = page.get('headers', {})
+        etag = headers.get('ETag')
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(page.get('status', 200))
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(page['body'])))
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(page['body'])
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+
+def stand_in_server():
+    """ local HTTP server shared by the tests, pages are reset per call """
+    global _server
+    if not _server:
+        _server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StandInHandler)
+        _server.url = 'http://127.0.0.1:%s/' % _server.server_address[1]
+        thread = threading.Thread(target=_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    _server.pages = {}
+    _server.requests = []
+    return _server
+
+
+# non-ASCII page body, as raw utf-8 bytes
+UTF8_BODY = u'caf\xe9 \u2603 '.encode('utf8') * 100
+
+
 RANDOM_URL = ('http://www.random.org/integers/?num=1&min=-1000000000&'
               'max=1000000000&col=1&base=10&format=plain&rnd=new')
 
@@ -28,6 +91,23 @@ class KernelTests(TestCase):
                         {'update_mins': None, 'storage_engine': 'dummy',
                          'onchanged': [],
                         },
+                       'streamed':
+                        {'update_mins': 30, 'storage_engine': 'dummy',
+                         'onchanged': [], 'stream': True,
+                        },
+                       'compressed':
+                        {'update_mins': 30, 'storage_engine': 'dummy',
+                         'onchanged': [], 'compression': 'zlib',
+                        },
+                       'delta':
+                        {'update_mins': 30, 'storage_engine': 'dummy',
+                         'onchanged': [], 'delta_interval': 3,
+                         'deduplicate': True,
+                        },
+                       'extract':
+                        {'update_mins': 30, 'storage_engine': 'dummy',
+                         'onchanged': [], 'extract_text': extract_upper,
+                        },
                        'change-hook':
                         {'update_mins': 30, 'storage_engine': 'dummy',
                          'onchanged': [hook_fired]
@@ -60,7 +140,8 @@ class KernelTests(TestCase):
         assert '_random' in obj
         assert obj['doc_class'] == 'default'
         assert obj['metadata'] == {'pi': 3}
-        assert obj['versions'] == []
+        assert obj['latest_version'] is None
+        assert obj['version_count'] == 0
 
         # track same url again with same metadata returns id
         id2 = self.kernel.track_url('http://example.com', 'default', pi=3)
@@ -84,6 +165,51 @@ class KernelTests(TestCase):
                               pi=3)
         self.kernel.db.tracked.find_one({'_id': 'fixed-id'})['metadata']['pi'] == 3
 
+    def test_track_urls(self):
+        self.kernel.track_url('http://example.com/existing', 'default', pi=3)
+        self.kernel.track_url('http://example.com/2', 'default', 'fixed-id')
+
+        results = self.kernel.track_urls([
+            {'url': 'http://example.com/new', 'doc_class': 'default'},
+            {'url': 'http://example.com/existing', 'doc_class': 'default',
+             'metadata': {'pi': 3}},
+            {'url': 'http://example.com/2', 'doc_class': 'default',
+             'id': 'fixed-id', 'metadata': {'pi': 4}},
+            {'url': 'http://example.com/3', 'doc_class': 'default',
+             'id': 'fixed-id'},
+            {'url': 'http://example.com/new', 'doc_class': 'default'},
+        ], batch_size=2)
+
+        statuses = [status for id, status in results]
+        assert statuses == [TRACK_CREATED, TRACK_UNCHANGED, TRACK_UPDATED,
+                            TRACK_CONFLICT, TRACK_UNCHANGED]
+        assert results[0][0] == results[4][0]
+        assert results[2][0] == 'fixed-id'
+        assert results[3][0] is None
+        assert self.kernel.db.tracked.count() == 3
+        fixed = self.kernel.db.tracked.find_one({'_id': 'fixed-id'})
+        assert fixed['metadata'] == {'pi': 4}
+
+        # unregistered doc_class is an error like track_url
+        assert_raises(ValueError, self.kernel.track_urls,
+                      [{'url': 'http://example.com', 'doc_class': 'bad'}])
+
+    def test_track_urls_race(self):
+        # another process tracked these ids between lookup & insert
+        self.kernel.track_url('http://example.com/a', 'default', 'a', pi=3)
+        self.kernel.track_url('http://example.com/b', 'default', 'b')
+        specs = [{'url': 'http://example.com/a', 'doc_class': 'default',
+                  'id': 'a', 'metadata': {'pi': 4}},
+                 {'url': 'http://example.com/b', 'doc_class': 'default',
+                  'id': 'b'}]
+        results = [('a', TRACK_CREATED), ('b', TRACK_CREATED)]
+        newdocs = [{'_id': 'a', '_random': -1}, {'_id': 'b', '_random': -1}]
+
+        results = self.kernel._resolve_duplicates(specs, results, newdocs)
+        assert results == [('a', TRACK_UPDATED), ('b', TRACK_UNCHANGED)]
+        doc = self.kernel.db.tracked.find_one({'_id': 'a'})
+        assert doc['metadata'] == {'pi': 4}
+
     def test_no_update(self):
         # update
         self.kernel.track_url('http://example.com', 'one-time')
@@ -96,6 +222,21 @@ class KernelTests(TestCase):
         assert self.kernel.get_update_queue() == []
         assert self.kernel.get_update_queue_size() == 0
 
+    def test_conditional_headers(self):
+        doc = {'latest_version': None}
+        assert self.kernel._conditional_headers(doc) == {}
+
+        doc['latest_version'] = {'etag': '"abc"',
+                                 'last_modified':
+                                    'Sat, 01 Jan 2000 00:00:00 GMT'}
+        headers = self.kernel._conditional_headers(doc)
+        assert headers['If-None-Match'] == '"abc"'
+        assert headers['If-Modified-Since'] == 'Sat, 01 Jan 2000 00:00:00 GMT'
+
+        # old versions w/o validators don't send conditional headers
+        doc['latest_version'] = {'etag': None, 'last_modified': None}
+        assert self.kernel._conditional_headers(doc) == {}
+
     def test_md5_versioning(self):
         assert not self.kernel.md5_versioning('hello!', 'hello!')
         assert self.kernel.md5_versioning('hello!', 'hey!')
@@ -113,18 +254,304 @@ class KernelTests(TestCase):
         first_update = newobj['last_update']
         assert newobj['consecutive_errors'] == 0
 
-        assert len(newobj['versions']) == 1
+        assert newobj['version_count'] == 1
+        assert newobj['latest_version'] == self.kernel.get_version(newobj, 0)
 
         # and do another update..
         self.kernel.update(obj)
 
         # hopefully example.com hasn't changed, this tests that md5 worked
-        assert len(newobj['versions']) == 1
+        newobj = self.kernel.db.tracked.find_one()
+        assert newobj['version_count'] == 1
+        assert self.kernel.get_versions(newobj).count() == 1
 
         # check that appropriate metadata updated
         newobj = self.kernel.db.tracked.find_one()
         assert first_update < newobj['last_update']
 
+    def test_update_not_modified(self):
+        server = stand_in_server()
+        server.pages['/etag'] = {'body': 'hello', 'headers': {'ETag': '"v1"'}}
+        self.kernel.track_url(server.url + 'etag', 'default')
+        self.kernel.update(self.kernel.db.tracked.find_one())
+        doc = self.kernel.db.tracked.find_one()
+        assert doc['latest_version']['etag'] == '"v1"'
+
+        # the stored ETag is sent back & the 304 isn't an error
+        self.kernel.update(doc)
+        assert server.requests[-1].get('If-None-Match') == '"v1"'
+        doc = self.kernel.db.tracked.find_one()
+        assert doc['consecutive_errors'] == 0
+        assert doc['version_count'] == 1
+
+        # a new ETag on the same content is remembered for next time
+        server.pages['/etag']['headers']['ETag'] = '"v2"'
+        self.kernel.update(doc)
+        doc = self.kernel.db.tracked.find_one()
+        assert doc['version_count'] == 1
+        assert doc['latest_version']['etag'] == '"v2"'
+        assert self.kernel.get_version(doc, 0)['etag'] == '"v2"'
+
+    def test_update_records_md5(self):
+        self.kernel.track_url('http://example.com', 'default')
+        obj = self.kernel.db.tracked.find_one()
+        self.kernel.update(obj)
+
+        newobj = self.kernel.db.tracked.find_one()
+        version = newobj['latest_version']
+        data = self.kernel.storage['dummy'].get(version['storage_key'])
+        assert version['md5'] == hashlib.md5(data).hexdigest()
+        assert self.kernel.version_md5(version) == version['md5']
+
+        # versions without a recorded md5 fall back to storage
+        del version['md5']
+        assert (self.kernel.version_md5(version) ==
+                hashlib.md5(data).hexdigest())
+
+    def test_scraper_throttle_threadsafe(self):
+        kernel = Kernel(mongo_db='oyster_test', rpm=600)
+        start = time.time()
+        threads = [threading.Thread(target=kernel.scraper._throttle)
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # requests are spaced 0.1s apart rather than sent all at once
+        assert time.time() - start >= 0.35
+
+    def test_update_md5_of_raw_bytes(self):
+        server = stand_in_server()
+        server.pages['/utf8'] = {'body': UTF8_BODY}
+        # same md5 whether or not the document is streamed
+        for doc_class in ('default', 'streamed'):
+            self.kernel.track_url(server.url + 'utf8', doc_class,
+                                  id=doc_class)
+            self.kernel.update(self.kernel.db.tracked.find_one(doc_class))
+            doc = self.kernel.db.tracked.find_one(doc_class)
+            assert doc['consecutive_errors'] == 0
+            assert (doc['latest_version']['md5'] ==
+                    hashlib.md5(UTF8_BODY).hexdigest())
+
+        # response sizes are in bytes, not decoded characters
+        self.kernel.metrics.flush()
+        sizes = self.kernel.db.metrics.find_one(
+            {'name': 'oyster_response_bytes',
+             'labels.doc_class': 'default'})
+        assert sizes['sum'] == len(UTF8_BODY)
+
+    def test_update_many(self):
+        self.kernel.track_url('http://example.com', 'default')
+        self.kernel.track_url('http://not_a_url', 'default')
+        self.kernel.track_url('http://example.com/bad-class', 'default')
+        self.kernel.db.tracked.update({'url': 'http://example.com/bad-class'},
+                                      {'$set': {'doc_class': 'missing'}})
+        docs = self.kernel.db.tracked.find()
+        self.kernel.update_many(docs, concurrency=3)
+
+        good = self.kernel.db.tracked.find_one({'url': 'http://example.com'})
+        assert good['version_count'] == 1
+        assert good['consecutive_errors'] == 0
+
+        bad = self.kernel.db.tracked.find_one({'url': 'http://not_a_url'})
+        assert bad['consecutive_errors'] == 1
+
+        # a doc that raises is logged & skipped without stopping the batch
+        skipped = self.kernel.db.tracked.find_one(
+            {'url': 'http://example.com/bad-class'})
+        assert 'last_update' not in skipped
+
+    def test_update_streamed(self):
+        self.kernel.track_url('http://example.com', 'streamed')
+        obj = self.kernel.db.tracked.find_one()
+        self.kernel.update(obj)
+
+        newobj = self.kernel.db.tracked.find_one()
+        assert newobj['consecutive_errors'] == 0
+        version = newobj['latest_version']
+        data = self.kernel.storage['dummy'].get(version['storage_key'])
+        assert 'Example Domain' in data
+        assert version['md5'] == hashlib.md5(data).hexdigest()
+
+        # unchanged, so no new version
+        self.kernel.update(newobj)
+        assert self.kernel.db.tracked.find_one()['version_count'] == 1
+
+    def test_update_streamed_error(self):
+        server = stand_in_server()
+        server.pages['/gone'] = {'status': 500, 'body': 'server error'}
+        self.kernel.track_url(server.url + 'gone', 'streamed')
+        self.kernel.update(self.kernel.db.tracked.find_one())
+
+        # error bodies aren't stored as versions
+        doc = self.kernel.db.tracked.find_one()
+        assert doc['consecutive_errors'] == 1
+        assert doc['version_count'] == 0
+
+    def test_update_compressed(self):
+        # non-ASCII pages are compressed as raw bytes
+        server = stand_in_server()
+        server.pages['/utf8'] = {'body': UTF8_BODY}
+        self.kernel.track_url(server.url + 'utf8', 'compressed')
+        obj = self.kernel.db.tracked.find_one()
+        self.kernel.update(obj)
+
+        newobj = self.kernel.db.tracked.find_one()
+        assert newobj['consecutive_errors'] == 0
+        version = newobj['latest_version']
+        assert version['compression'] == 'zlib'
+        stored = self.kernel.storage['dummy'].get(version['storage_key'])
+        data = self.kernel.get_last_version(newobj)
+        assert data == UTF8_BODY
+        assert len(stored) < len(data)
+        assert version['md5'] == hashlib.md5(data).hexdigest()
+
+        # unknown codecs are rejected
+        assert_raises(ValueError, Kernel, doc_classes={
+            'bad': {'update_mins': 1, 'onchanged': [], 'compression': 'xz'}})
+
+    def test_delta_versions(self):
+        self.kernel.track_url('http://example.com', 'delta')
+        doc = self.kernel.db.tracked.find_one()
+        doc_class = self.kernel.doc_classes['delta']
+        storage = self.kernel.dedup_storage['dummy']
+
+        base = ''.join('line %s\n' % i for i in range(100))
+        texts = [base + 'change %s\n' % i for i in range(5)]
+        chains = []
+        sizes = []
+        # store versions the way update does
+        for i, text in enumerate(texts):
+            stored, fields = self.kernel._delta_encode(doc, doc_class, text)
+            version = dict(fields, _id=ObjectId(), storage_type='dummy',
+                           storage_key=storage.put(doc, stored, 'text/plain'),
+                           timestamp=datetime.datetime(2012, 1, i + 1))
+            self.kernel.db.versions.insert(dict(version,
+                                                tracked_id=doc['_id']))
+            doc['latest_version'] = version
+            doc['version_count'] = i + 1
+            chains.append(version.get('chain', 0))
+            sizes.append(len(stored))
+
+        # snapshot every 3 versions, deltas are smaller than full copies
+        assert chains == [0, 1, 2, 0, 1]
+        assert sizes[1] < len(texts[1])
+
+        for i, text in enumerate(texts):
+            assert self.kernel.get_version_data_at(doc, i) == text
+        assert self.kernel.get_last_version(doc) == texts[-1]
+
+        # updates delta-encode the raw bytes of non-ASCII pages
+        server = stand_in_server()
+        self.kernel.track_url(server.url + 'utf8', 'delta', id='utf8')
+        bodies = [(UTF8_BODY + '\n') * 5 + 'change %s' % i for i in range(3)]
+        for body in bodies:
+            server.pages['/utf8'] = {'body': body}
+            self.kernel.update(self.kernel.db.tracked.find_one('utf8'))
+        doc = self.kernel.db.tracked.find_one('utf8')
+        assert doc['consecutive_errors'] == 0
+        assert doc['latest_version']['chain'] == 2
+        for i, body in enumerate(bodies):
+            assert self.kernel.get_version_data_at(doc, i) == body
+
+        # can't combine with streaming
+        assert_raises(ValueError, Kernel, doc_classes={
+            'bad': {'update_mins': 1, 'onchanged': [], 'stream': True,
+                    'delta_interval': 5}})
+        # or with storage that reuses keys between versions
+        assert_raises(ValueError, Kernel, doc_classes={
+            'bad': {'update_mins': 1, 'onchanged': [],
+                    'storage_engine': 'dummy', 'delta_interval': 5}})
+
+    def test_get_version(self):
+        self.kernel.track_url('http://example.com', 'default')
+        doc = self.kernel.db.tracked.find_one()
+        assert_raises(IndexError, self.kernel.get_version, doc, 0)
+
+        # fake a few versions
+        for i in range(3):
+            self.kernel.db.versions.insert({
+                'tracked_id': doc['_id'], 'storage_key': i,
+                'timestamp': datetime.datetime(2012, 1, i + 1)})
+        doc['version_count'] = 3
+
+        assert self.kernel.get_version(doc, 0)['storage_key'] == 0
+        assert self.kernel.get_version(doc, -1)['storage_key'] == 2
+        assert [v['storage_key'] for v in self.kernel.get_versions(doc)] == \
+                [0, 1, 2]
+        assert_raises(IndexError, self.kernel.get_version, doc, 3)
+
+    def test_storage_cache_per_version(self):
+        self.kernel.storage_cache = StorageCache(10000)
+        self.kernel.track_url('http://example.com', 'default')
+        doc = self.kernel.db.tracked.find_one()
+        dummy = self.kernel.storage['dummy']
+
+        # dummy storage reuses the same key for every version
+        versions = []
+        for text in ('version 1', 'version 2'):
+            versions.append({'_id': ObjectId(), 'storage_type': 'dummy',
+                             'storage_key': dummy.put(doc, text, 'text/plain')})
+            assert self.kernel.get_version_data(versions[-1]) == text
+        assert self.kernel.get_version_data(versions[-1]) == 'version 2'
+
+        # updates cache the raw bytes they store for the onchanged hooks
+        server = stand_in_server()
+        server.pages['/utf8'] = {'body': UTF8_BODY}
+        self.kernel.track_url(server.url + 'utf8', 'default', id='utf8')
+        self.kernel.update(self.kernel.db.tracked.find_one('utf8'))
+        version = self.kernel.db.tracked.find_one('utf8')['latest_version']
+        hits = self.kernel.storage_cache.hits
+        assert self.kernel.get_version_data(version) == UTF8_BODY
+        assert self.kernel.storage_cache.hits == hits + 1
+
+    def test_update_timing(self):
+        timed = []
+        self.kernel.timing = True
+        self.kernel.timing_hook = lambda doc, timer: timed.append(timer)
+
+        self.kernel.track_url('http://example.com', 'default')
+        obj = self.kernel.db.tracked.find_one()
+        self.kernel.update(obj)
+
+        assert len(timed) == 1
+        timer = timed[0]
+        for phase in ('setup', 'fetch', 'hash', 'put', 'save'):
+            assert phase in timer.durations
+        assert timer.bytes['fetch'] > 0
+
+        stats = self.kernel.db.update_stats.find_one()
+        assert stats['doc_class'] == 'default'
+        assert stats['count'] == 1
+        assert stats['seconds']['fetch'] == timer.durations['fetch']
+
+        log = self.kernel.db.logs.find_one({'timings': {'$exists': True}})
+        assert log['bytes']['fetch'] == timer.bytes['fetch']
+
+    def test_extract_text_cached(self):
+        del extract_calls[:]
+        self.kernel.track_url('http://example.com', 'extract')
+        obj = self.kernel.db.tracked.find_one()
+        self.kernel.update(obj)
+        doc = self.kernel.db.tracked.find_one()
+
+        text = self.kernel.extract_text(doc)
+        assert 'EXAMPLE DOMAIN' in text
+        assert self.kernel.extract_text(doc) == text
+        assert len(extract_calls) == 1
+
+        # new extractor version means extracting again
+        self.kernel.doc_classes['extract']['extract_text_version'] = 2
+        assert self.kernel.extract_text(doc) == text
+        assert len(extract_calls) == 2
+        assert self.kernel.db.extracted_text.count() == 1
+
+        # doc classes without extract_text are an error
+        self.kernel.track_url('http://example.com/2', 'default')
+        assert_raises(ValueError, self.kernel.extract_text,
+                      self.kernel.db.tracked.find_one({'doc_class':
+                                                       'default'}))
+
     def test_update_failure(self):
         # track a non-existent URL
         self.kernel.track_url('http://not_a_url', 'default')
@@ -140,6 +567,42 @@ class KernelTests(TestCase):
         obj = self.kernel.db.tracked.find_one()
         assert obj['consecutive_errors'] == 2
 
+    def test_adaptive_update_mins(self):
+        doc_class = {'update_mins': 60, 'onchanged': [],
+                     'min_update_mins': 10, 'max_update_mins': 1440}
+        now = datetime.datetime(2012, 1, 1)
+        doc = {}
+        adapt = self.kernel._adaptive_update_mins
+
+        def version(mins_ago):
+            return {'timestamp': now - datetime.timedelta(minutes=mins_ago)}
+
+        # first version uses update_mins, unchanged polls back off
+        assert_equal(adapt(doc, doc_class, True, None, now), 60)
+        assert_equal(adapt(doc, doc_class, False, version(60), now), 120)
+        assert doc['change_mins'] is None
+
+        # a change polls twice per expected change
+        assert_equal(adapt(doc, doc_class, True, version(180), now), 90)
+        assert_equal(doc['change_mins'], 180)
+        # no backing off until the change is overdue
+        assert_equal(adapt(doc, doc_class, False, version(90), now), 90)
+        assert_equal(adapt(doc, doc_class, False, version(200), now), 180)
+        assert_equal(doc['change_mins'], 200)
+
+        # bounded by max_update_mins & min_update_mins
+        for i in range(10):
+            adapt(doc, doc_class, False, version(5000), now)
+        assert_equal(doc['update_interval'], 1440)
+        for i in range(10):
+            adapt(doc, doc_class, True, version(5), now)
+        assert_equal(doc['update_interval'], 10)
+
+        # min_update_mins can't exceed max_update_mins
+        assert_raises(ValueError, Kernel, doc_classes={
+            'bad': {'update_mins': 60, 'onchanged': [],
+                    'min_update_mins': 100, 'max_update_mins': 50}})
+
     #def test_update_onchanged_fire_only_on_change(self):
     #    self.kernel.track_url('http://example.com', 'change-hook')
     #    obj = self.kernel.db.tracked.find_one()
@@ -193,6 +656,50 @@ class KernelTests(TestCase):
         queue = self.kernel.get_update_queue()
         assert len(queue) == 3
 
+    def test_claim_update_queue(self):
+        self.kernel.track_url('a', 'fast-update')
+        self.kernel.track_url('b', 'fast-update')
+        self.kernel.track_url('c', 'fast-update')
+
+        first = self.kernel.claim_update_queue(2)
+        assert len(first) == 2
+        assert self.kernel.get_leased_count() == 2
+        assert self.kernel.get_update_queue_size() == 1
+
+        # already leased docs can't be claimed again
+        second = self.kernel.claim_update_queue(5)
+        assert len(second) == 1
+        assert second[0] not in first
+        assert self.kernel.claim_update_queue(5) == []
+
+        # updating a doc releases its lease
+        doc = self.kernel.db.tracked.find_one({'_id': first[0]})
+        self.kernel.update(doc)
+        assert self.kernel.get_leased_count() == 2
+        time.sleep(1)
+        assert self.kernel.claim_update_queue(5) == [first[0]]
+
+    def test_status_summary(self):
+        self.kernel.track_url('a', 'fast-update')
+        self.kernel.track_url('b', 'fast-update')
+        self.kernel.track_url('c', 'one-time')
+
+        summary = self.kernel.get_status_summary()
+        assert summary['tracking'] == 3
+        assert summary['need_update'] == 3
+        by_class = dict((dc['doc_class'], dc) for dc in
+                        summary['doc_classes'])
+        assert by_class['fast-update']['tracking'] == 2
+        assert by_class['one-time']['need_update'] == 1
+        assert by_class['default']['tracking'] == 0
+        assert summary['leased'] == 0
+        assert summary['update_lag'] == 0
+
+        # cached until it is older than max_age
+        self.kernel.track_url('d', 'fast-update')
+        assert self.kernel.get_status_summary()['tracking'] == 3
+        assert self.kernel.get_status_summary(max_age=0)['tracking'] == 4
+
     def test_get_update_queue_size(self):
         self.kernel.track_url('a', 'fast-update')
         self.kernel.track_url('b', 'fast-update')
@@ -0,0 +1,48 @@
+import unittest
+
+import pymongo
+from ..metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    DB_NAME = 'oyster_test'
+
+    def setUp(self):
+        pymongo.Connection().drop_database(self.DB_NAME)
+        self.db = pymongo.Connection()[self.DB_NAME]
+
+    def tearDown(self):
+        pymongo.Connection().drop_database(self.DB_NAME)
+
+    def test_aggregate_across_processes(self):
+        # two Metrics objects stand in for two workers
+        first = Metrics(self.db, flush_seconds=60)
+        second = Metrics(self.db, flush_seconds=60)
+        first.inc('oyster_updates_total', {'doc_class': 'a'})
+        second.inc('oyster_updates_total', {'doc_class': 'a'}, 2)
+        second.inc('oyster_updates_total', {'doc_class': 'b'})
+        # nothing is written until a flush
+        self.assertEqual(self.db.metrics.count(), 0)
+        first.flush()
+        second.flush()
+
+        text = first.render()
+        self.assertTrue('# TYPE oyster_updates_total counter' in text)
+        self.assertTrue('oyster_updates_total{doc_class="a"} 3' in text)
+        self.assertTrue('oyster_updates_total{doc_class="b"} 1' in text)
+
+    def test_histogram(self):
+        metrics = Metrics(self.db, flush_seconds=0)
+        metrics.observe('oyster_fetch_seconds', 0.2)
+        metrics.observe('oyster_fetch_seconds', 3)
+        metrics.observe('oyster_fetch_seconds', 1000)
+
+        text = metrics.render({'oyster_update_queue_size': 7})
+        self.assertTrue('oyster_fetch_seconds_bucket{le="0.1"} 0' in text)
+        self.assertTrue('oyster_fetch_seconds_bucket{le="0.25"} 1' in text)
+        self.assertTrue('oyster_fetch_seconds_bucket{le="5"} 2' in text)
+        self.assertTrue('oyster_fetch_seconds_bucket{le="+Inf"} 3' in text)
+        self.assertTrue('oyster_fetch_seconds_count 3' in text)
+        self.assertTrue('oyster_fetch_seconds_sum 1003.2' in text)
+        self.assertTrue('oyster_update_queue_size 7' in text)
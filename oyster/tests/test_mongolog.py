@@ -51,3 +51,24 @@ class TestMongoLog(unittest.TestCase):
             logged = self.logs.find_one(sort=[('$natural', -1)])
         self.assertEqual(logged['levelname'], 'WARNING')
         self.assertTrue('error!' in logged['exc_info'])
+
+    def test_buffered_write(self):
+        self.log.handlers = []
+        handler = MongoHandler(self.DB_NAME, capped_size=None, async=False,
+                               buffered=True, buffer_size=10,
+                               flush_interval=0.1)
+        self.log.addHandler(handler)
+
+        for i in xrange(25):
+            self.log.debug('test %s', i)
+        handler.flush()
+        self.assertEqual(self.logs.count(), 25)
+
+        # anything left is written on close
+        self.log.debug('last')
+        handler.close()
+        self.assertEqual(self.logs.count(), 26)
+
+    def test_buffered_overflow(self):
+        self.assertRaises(ValueError, MongoHandler, self.DB_NAME,
+                          buffered=True, overflow='explode')
@@ -1,9 +1,20 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
 from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises
 
 from oyster.conf import settings
 from oyster.core import Kernel
 from oyster.storage.gridfs import GridFSStorage
 from oyster.storage.dummy import DummyStorage
+from oyster.storage.filesystem import FileSystemStorage
+from oyster.storage.dedup import DedupStorage
+from oyster.storage import compression
+from oyster.storage.delta import make_delta, apply_delta
+from oyster.storage.cache import StorageCache
 
 
 def _simple_storage_test(StorageCls):
@@ -21,6 +32,10 @@ def _simple_storage_test(StorageCls):
 
     assert storage.get(storage_id) == 'hello oyster'
 
+    # file-like objects can be stored too
+    storage_id = storage.put(doc, StringIO('hello file'), 'text/plain')
+    assert storage.get(storage_id) == 'hello file'
+
 
 def test_s3():
     if not hasattr(settings, 'AWS_BUCKET'):
@@ -35,3 +50,141 @@ def test_gridfs():
 
 def test_dummy():
     _simple_storage_test(DummyStorage)
+
+
+def test_filesystem():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        settings.FILESYSTEM_STORAGE_ROOT = tmpdir
+        settings.FILESYSTEM_STORAGE_FSYNC = True
+        kernel = Kernel(mongo_db='oyster_test')
+        storage = FileSystemStorage(kernel)
+        assert storage.storage_type == 'filesystem'
+
+        doc = {'_id': 'aabbccddeeff', 'url': 'http://localhost:8000/#test',
+               'doc_class': 'default', 'metadata': {}}
+        storage_id = storage.put(doc, 'hello oyster', 'text/plain')
+        # get returns an mmap
+        assert storage.get(storage_id)[:] == 'hello oyster'
+        assert os.path.exists(os.path.join(tmpdir, storage_id[:2],
+                                           storage_id[2:4], storage_id))
+
+        storage_id = storage.put(doc, StringIO('hello file'), 'text/plain')
+        assert storage.get(storage_id)[:] == 'hello file'
+
+        assert storage.get(storage.put(doc, '', 'text/plain')) == ''
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_dedup():
+    kernel = Kernel(mongo_db='oyster_test')
+    kernel._wipe()
+    kernel.doc_classes['default'] = {}
+    inner = DummyStorage(kernel)
+    storage = DedupStorage(kernel, inner)
+    assert storage.storage_type == 'dummy'
+
+    doc1 = {'_id': 'doc1', 'url': 'http://example.com/1',
+            'doc_class': 'default', 'metadata': {}}
+    doc2 = {'_id': 'doc2', 'url': 'http://example.com/2',
+            'doc_class': 'default', 'metadata': {}}
+
+    key1 = storage.put(doc1, 'same data', 'text/plain')
+    key2 = storage.put(doc2, StringIO('same data'), 'text/plain')
+    assert key1 == key2
+    assert len(inner._storage) == 1
+    assert kernel.db.blobs.find_one()['refs'] == 2
+    assert storage.get(key1) == 'same data'
+
+    key3 = storage.put(doc1, 'new data', 'text/plain')
+    assert key3 != key1
+    assert len(inner._storage) == 2
+
+
+def test_compression():
+    data = 'hello oyster ' * 1000
+    for codec in compression.codecs:
+        compressed = compression.compress(data, codec)
+        assert len(compressed) < len(data)
+        assert compression.decompress(compressed, codec) == data
+
+        compressed = compression.compress(StringIO(data), codec, 1)
+        assert compression.decompress(compressed.read(), codec) == data
+
+    # zlib level 0 stores without compressing
+    assert len(compression.compress(data, 'zlib', 0)) > len(data)
+
+    # uncompressed data passes straight through
+    assert compression.decompress(data, None) == data
+
+
+def test_delta():
+    old = ''.join('line %s\n' % i for i in range(1000))
+    new = old.replace('line 5\n', 'changed\n')[:-9] + 'new tail'
+    delta = make_delta(old, new)
+    assert len(delta) < 100
+    assert apply_delta(old, delta) == new
+
+    # works from & to nothing and on data without newlines
+    assert apply_delta('', make_delta('', new)) == new
+    assert apply_delta(new, make_delta(new, '')) == ''
+    assert apply_delta('abc', make_delta('abc', 'abd')) == 'abd'
+
+    # non-ASCII data is fine as bytes, but not as decoded text
+    utf8 = u'caf\xe9\n'.encode('utf8')
+    assert apply_delta(utf8, make_delta(utf8, utf8 + 'x')) == utf8 + 'x'
+    assert_raises(TypeError, make_delta, u'caf\xe9\n', 'cafe\n')
+
+
+class CountingMetrics(object):
+    def __init__(self):
+        self.counts = {}
+
+    def inc(self, name, labels=None, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+
+def test_storage_cache():
+    metrics = CountingMetrics()
+    cache = StorageCache(10, metrics=metrics)
+    assert cache.get('a') is None
+    cache.set('a', '12345')
+    cache.set('b', '12345')
+    assert cache.get('a') == '12345'
+    # b is least recently used & gets evicted
+    cache.set('c', '12345')
+    assert cache.get('b') is None
+    assert cache.get('c') == '12345'
+    # too big to cache at all
+    cache.set('d', 'x' * 11)
+    assert cache.get('d') is None
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 3
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 10
+    # ... and counted for /metrics
+    assert metrics.counts == {'oyster_storage_cache_hits_total': 2,
+                              'oyster_storage_cache_misses_total': 3,
+                              'oyster_storage_cache_evictions_total': 1}
+
+
+def test_storage_cache_spill():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = StorageCache(10, spill_dir=tmpdir, spill_max_bytes=20)
+        cache.set('a', '12345')
+        # another worker on the same host sees the spilled data
+        other = StorageCache(10, spill_dir=tmpdir, spill_max_bytes=20)
+        assert other.get('a') == '12345'
+        assert other.stats()['disk_hits'] == 1
+        # setting a key again replaces the spilled data
+        cache.set('a', '67890')
+        assert StorageCache(10, spill_dir=tmpdir).get('a') == '67890'
+        # spill directory is kept under budget
+        for key in 'bcdef':
+            cache.set(key, '12345')
+        assert sum(os.path.getsize(os.path.join(tmpdir, f))
+                   for f in os.listdir(tmpdir)) <= 20
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,42 @@
+"""
+    per-phase timing of Kernel.update
+
+    timers are passed through update and mark() is called at the end of each
+    phase, so when timing is off the only cost is a no-op method call
+"""
+
+import time
+
+
+class PhaseTimer(object):
+    """ records seconds spent & bytes handled in each phase of an update """
+
+    def __init__(self):
+        self.durations = {}
+        self.bytes = {}
+        self._last = time.time()
+
+    def mark(self, phase):
+        """ attribute time since the previous mark to phase """
+        now = time.time()
+        self.durations[phase] = self.durations.get(phase, 0) + now - self._last
+        self._last = now
+
+    def add_bytes(self, phase, count):
+        self.bytes[phase] = self.bytes.get(phase, 0) + count
+
+    @property
+    def total(self):
+        return sum(self.durations.itervalues())
+
+
+class NullTimer(object):
+    """ stands in for PhaseTimer when timing is off """
+
+    def mark(self, phase):
+        pass
+
+    def add_bytes(self, phase, count):
+        pass
+
+NULL_TIMER = NullTimer()
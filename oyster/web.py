@@ -48,15 +48,43 @@ app = flask.Flask('oyster')
 @app.route('/')
 @api_wrapper('index.html')
 def index():
+    summary = kernel.get_status_summary(settings.STATUS_SUMMARY_TTL)
     status = {
-        'tracking': kernel.db.tracked.count(),
-        'need_update': kernel.get_update_queue_size(),
+        'tracking': summary['tracking'],
+        'need_update': summary['need_update'],
+        'doc_classes': summary['doc_classes'],
+        'updated_at': summary['updated_at'],
         'logs': list(kernel.db.logs.find().sort('$natural', -1).limit(100)),
         'mongo_host': settings.MONGO_HOST,
     }
     return status
 
 
+@app.route('/status/')
+def status():
+    summary = kernel.get_status_summary(settings.STATUS_SUMMARY_TTL)
+    return flask.Response(json.dumps(summary, cls=JSONEncoder),
+                          mimetype='application/json')
+
+
+@app.route('/metrics')
+def metrics():
+    kernel.metrics.flush()
+    # counts come from the cached summary so scrapes don't query tracked
+    summary = kernel.get_status_summary(settings.STATUS_SUMMARY_TTL)
+    age = datetime.datetime.utcnow() - summary['updated_at']
+    gauges = {
+        'oyster_tracked_documents': summary['tracking'],
+        'oyster_update_queue_size': summary['need_update'],
+        'oyster_leased_documents': summary['leased'],
+        'oyster_update_lag_seconds': summary.get('update_lag', 0),
+        'oyster_status_summary_age_seconds':
+            age.days * 86400 + age.seconds + age.microseconds / 1e6,
+    }
+    return flask.Response(kernel.metrics.render(gauges),
+                          mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/log/')
 @api_wrapper('logs.html')
 def log_view():
@@ -69,11 +97,70 @@ def log_view():
                 next_offset=next_offset, offset=offset)
 
 
+def _parse_id(id):
+    """ ids are either ObjectIds or user-specified strings """
+    if bson.objectid.ObjectId.is_valid(id):
+        return bson.objectid.ObjectId(id)
+    return id
+
+
 @app.route('/tracked/')
-@api_wrapper()
 def tracked():
-    tracked = list(kernel.db.tracked.find())
-    return json.dumps(tracked, cls=JSONEncoder)
+    """
+    page through tracked documents in _id order
+
+    doc_class, prefix (of url) & errors (only documents with errors)
+    filter the results, fields limits the returned fields.  Pages hold up
+    to limit documents, pass the returned next value as after to get the
+    next page.  format=ndjson instead streams every matching document, one
+    JSON object per line.
+
+    string ids sort before ObjectIds, so paging moves on to the ObjectIds
+    once the string ids run out.
+    """
+    args = flask.request.args
+    spec = {}
+    if args.get('doc_class'):
+        spec['doc_class'] = args['doc_class']
+    if args.get('prefix'):
+        # anchored regex can use the url index
+        spec['url'] = {'$regex': '^' + re.escape(args['prefix'])}
+    if 'errors' in args:
+        spec['consecutive_errors'] = {'$gt': 0}
+    fields = None
+    if args.get('fields'):
+        fields = args['fields'].split(',')
+
+    if args.get('format') == 'ndjson':
+        cursor = kernel.db.tracked.find(spec, fields=fields).sort('_id')
+
+        def generate():
+            for doc in cursor:
+                yield json.dumps(doc, cls=JSONEncoder) + '\n'
+        return flask.Response(generate(), mimetype='application/x-ndjson')
+
+    try:
+        limit = int(args.get('limit', 100))
+    except ValueError:
+        flask.abort(400)
+    # limit(0) would mean no limit at all
+    limit = max(1, min(limit, 1000))
+
+    after = None
+    if args.get('after'):
+        after = _parse_id(args['after'])
+        spec['_id'] = {'$gt': after}
+    docs = list(kernel.db.tracked.find(spec, fields=fields).sort('_id')
+                .limit(limit))
+    # $gt only matches ids of the same type, continue on to the ObjectIds
+    if isinstance(after, basestring) and len(docs) < limit:
+        spec['_id'] = {'$type': 7}
+        docs += list(kernel.db.tracked.find(spec, fields=fields).sort('_id')
+                     .limit(limit - len(docs)))
+    next = docs[-1]['_id'] if len(docs) == limit else None
+    return flask.Response(json.dumps({'tracked': docs, 'next': next},
+                                     cls=JSONEncoder),
+                          mimetype='application/json')
 
 
 @app.route('/tracked/<id>')
@@ -31,7 +31,7 @@ setup(name="oyster",
                    "Operating System :: OS Independent",
                    "Programming Language :: Python",
                    ],
-      install_requires=["httplib2 >= 0.6.0", "scrapelib >= 0.7.2",
+      install_requires=["httplib2 >= 0.6.0", "scrapelib >= 0.7.2, < 0.8",
                         "pymongo >= 1.11", "flask", "celery"],
       tests_require=["nose"],
       test_suite='nose.collector',